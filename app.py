@@ -1,208 +1,215 @@
 # import necessary libraries
 import streamlit as st
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_community.tools.tavily_search import TavilySearchResults
-from fpdf import FPDF
-import PyPDF2
-import docx
-import logging
 from datetime import datetime
 import os
 import time
+import uuid
+from jobs import DONE, FAILED, QUEUED, JobQueue
+from metrics import Metrics, start_metrics_server
+from pipeline import (GROQ_DRAFT_MODEL, GROQ_MODEL, GROQ_RPM, SECTIONED_MIN_TOKENS, TAVILY_RPM, Clients,
+                      InsightPipeline)
+from result_cache import DocumentCache, ScrapeCache, InsightCache
+from reports import REPORT_FORMATS, ReportRenderer
+from retrieval import PassageIndex
+from session_logging import get_event_logger, get_session_logger
 
-# Initialize LLM and search tools
-llm = ChatGroq(api_key=st.secrets["GROQ_API_KEY"])
-search = TavilySearchResults(api_key=st.secrets["TAVILY_API_KEY"], max_results=2)
-parser = StrOutputParser()
+# define a function to read the API keys
+def get_secret(name, default=None):
+    """_summary_: Read a secret from the environment, falling back to the Streamlit secrets file.
+        _params_: name (str): The name of the secret, e.g. "GROQ_API_KEY".
+        default (str): The value to return if the secret is not set. Without it, a missing secret raises an error.
+    _returns_: str: The value of the secret.
+    """
+    if name in os.environ:
+        return os.environ[name]
+    try:
+        return st.secrets[name]
+    except (KeyError, FileNotFoundError):
+        if default is None:
+            raise
+        return default
 
-# define a function to set up session logging
-def setup_session_logging():
+# On-disk cache of website lookups, shared across sessions and processes
+SCRAPE_CACHE_TTL = 24 * 60 * 60  # seconds a cached lookup stays valid
+SCRAPE_CACHE_MAX_ENTRIES = 5000  # least recently used lookups are evicted beyond this
+
+# On-disk cache of generated insights, keyed by a fingerprint of the inputs and model settings
+INSIGHT_CACHE_TTL = 7 * 24 * 60 * 60  # seconds cached insights are served before they are regenerated
+INSIGHT_CACHE_MAX_ENTRIES = 500  # least recently used insights are evicted beyond this
+
+# On-disk cache of the text extracted from uploaded documents, keyed by the hash of the file
+DOCUMENT_CACHE_MAX_MB = 256  # least recently used documents are evicted beyond this much text
+
+# In-memory cache of the rendered reports, shared by every session of this process
+REPORT_CACHE_MAX_ENTRIES = 150  # rendered reports of the most recent insights kept in memory, all formats together
+
+# Background jobs that write the full reports, shared by every session and kept across reruns and reloads
+JOB_WORKERS = 4  # reports written at the same time by this process, across all sessions
+JOB_POLL_SECONDS = 1  # how often the page checks on its report
+JOB_PROGRESS_SECONDS = 0.5  # how often the partial text of a report is saved for the page to show
+
+# define the process-wide resources, shared by every session and rerun
+@st.cache_resource(show_spinner=False)
+def get_clients(groq_api_key, tavily_api_key, model_name, draft_model_name, groq_rpm, tavily_rpm):
+    """_summary_: Build the LLM and search clients once per process, keeping their connection pools open.
+        They are rebuilt only when one of the arguments changes.
+        _params_: groq_api_key (str): The Groq API key.
+        tavily_api_key (str): The Tavily API key.
+        model_name (str): The Groq model to use.
+        draft_model_name (str): The Groq model that writes the fast first draft.
+        groq_rpm (float): The Groq requests per minute allowed by the API key, for each model.
+        tavily_rpm (float): The Tavily searches per minute allowed by the API key.
+    _returns_: Clients: The shared client bundle, whose rate limits are shared by every session.
     """
-    _summary_: Set up logging for the current session. Creates a logger object and adds a file handler to log messages.
+    return Clients.from_keys(groq_api_key, tavily_api_key, model_name=model_name, draft_model_name=draft_model_name,
+                             groq_rpm=groq_rpm, tavily_rpm=tavily_rpm)
+
+@st.cache_resource(show_spinner=False)
+def get_renderer(max_entries=REPORT_CACHE_MAX_ENTRIES):
+    """_summary_: Create the report renderer once per process, so every session shares its rendered reports."""
+    return ReportRenderer(max_entries=max_entries)
+
+def get_report(insights, report_format, pipeline):
+    """_summary_: Build the report of the insights in memory, once per distinct insights text and format.
+        _params_: insights (str): The generated insights.
+        report_format (str): "pdf", "docx" or "html".
+        pipeline (InsightPipeline): The pipeline that renders the report.
+    _returns_: bytes: The report file.
     """
-    if 'logger' not in st.session_state:
-        # Create a logger object for the current session
-        session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_dir = "session_logs"
-        # Create the log directory if it does not exist
-        os.makedirs(log_dir, exist_ok=True)
-        logger = logging.getLogger(f"session_{session_id}")
-        logger.setLevel(logging.INFO)
-        # Create a file handler for the logger
-        file_handler = logging.FileHandler(f"{log_dir}/session_{session_id}.log")
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        # Store the logger in the session state object
-        st.session_state.logger = logger
+    result = pipeline.generate_report(insights, report_format)
+    if result.error:
+        raise RuntimeError(f"Error generating {report_format.upper()}: {result.error}")
+    return result.data
+
+@st.cache_resource(show_spinner=False)
+def get_scrape_cache(ttl=SCRAPE_CACHE_TTL, max_entries=SCRAPE_CACHE_MAX_ENTRIES):
+    """_summary_: Open the website lookup cache once per process."""
+    return ScrapeCache(ttl=ttl, max_entries=max_entries)
+
+@st.cache_resource(show_spinner=False)
+def get_passage_index():
+    """_summary_: Open the index of uploaded documents and generated insights once per process."""
+    return PassageIndex()
 
-# define the scrape_website function
-def scrape_website(url):
-    """_summary_: Scrape the content and key information from a website URL.
-        _params_: url (str): The URL of the website to scrape.
-    _returns_: dict: A dictionary containing the title and description of the website content.
+@st.cache_resource(show_spinner=False)
+def get_insight_cache(ttl=INSIGHT_CACHE_TTL, max_entries=INSIGHT_CACHE_MAX_ENTRIES):
+    """_summary_: Open the generated insights cache once per process."""
+    return InsightCache(ttl=ttl, max_entries=max_entries)
+
+@st.cache_resource(show_spinner=False)
+def get_document_cache(max_mb=DOCUMENT_CACHE_MAX_MB):
+    """_summary_: Open the cache of text extracted from uploaded documents once per process."""
+    return DocumentCache(max_bytes=max_mb * 1024 * 1024)
+
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    """_summary_: Create the stage timing counters once per process, and serve them to Prometheus at /metrics
+        on METRICS_HOST and METRICS_PORT. Set METRICS_HOST to 0.0.0.0 to let a Prometheus on another machine scrape it.
     """
+    metrics = Metrics(event_logger=get_event_logger())
+    start_metrics_server(metrics, int(get_secret("METRICS_PORT", "9464")), get_secret("METRICS_HOST", "127.0.0.1"))
+    return metrics
 
-    try:
-        # if the url is empty, return a default message and return a message
-        if not url.strip():
-            st.session_state.logger.warning("No URL provided for scraping")
-            return {"title": "No URL provided", "description": "No description available"}
-        response = search.invoke(f"summarize content and key information from {url}")
-        # if the response is not empty and has content, extract the title and description from the response and return it 
-        if response and len(response) > 0:
-            content = response[0].get('content', 'No description available')
-            title = response[0].get('title', 'No title available')
-            st.session_state.logger.info(f"Successfully scraped website: {url}")
-            return {"title": title, "description": content}
-        # if no data is found for the URL, return a message
-        st.session_state.logger.warning(f"No data found for URL: {url}")
-        return {"title": "No data found", "description": "Could not fetch data from URL"}
-    # if an exception occurs during the scraping process, log the error and return an error message
-    except Exception as e:
-        st.error(f"Error accessing {url}: {str(e)}")
-        st.session_state.logger.error(f"Error scraping website {url}: {str(e)}")
-        return {"title": "Error", "description": f"Error scraping website: {str(e)}"}
-
-# define the parse_uploaded_file function
-def parse_uploaded_file(file):
-    """_summary_: Parse the content of an uploaded PDF or DOCX file.
-        _params_: file (File): The uploaded file object.
-    _returns_: str: The text content extracted from the file, or None if the file type is not supported.
+# define a function to build the pipeline from the shared resources
+def build_pipeline(logger):
+    """_summary_: Build the insight pipeline on the process-wide clients, caches and metrics.
+        _params_: logger (logging.LoggerAdapter): The session logger the pipeline logs to.
+    _returns_: InsightPipeline: The pipeline.
     """
-    try:
-        # check the file type and extract the text content based on the file type
-        # pdf files are parsed using PyPDF2, and docx files are parsed using the python-docx library
-        if file.type == "application/pdf":
-            reader = PyPDF2.PdfReader(file)
-            content = " ".join([page.extract_text() for page in reader.pages])
-            st.session_state.logger.info(f"Successfully parsed PDF file: {file.name}")
-            return content
-        elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            doc = docx.Document(file)
-            content = " ".join([paragraph.text for paragraph in doc.paragraphs])
-            st.session_state.logger.info(f"Successfully parsed DOCX file: {file.name}")
-            return content
-        # otherwise, log a warning for unsupported file types and return None
-        st.session_state.logger.warning(f"Unsupported file type: {file.type}")
-        return None
-    # if an exception occurs during the parsing process, log the error and return None
-    except Exception as e:
-        st.error(f"Error parsing file: {str(e)}")
-        st.session_state.logger.error(f"Error parsing file {file.name}: {str(e)}")
-        return None
-
-# define the generate_insights function
-def generate_insights(inputs, temperature, max_tokens):
-    """_summary_: Generate insights for sales representatives based on the provided inputs.
-        _params_: inputs (dict): A dictionary containing the input data for generating insights.
-        temperature (float): The temperature parameter for the LLM model.
-        max_tokens (int): The maximum number of tokens to generate.
-    _returns_: str: The generated insights as a formatted string.
+    clients = get_clients(get_secret("GROQ_API_KEY"), get_secret("TAVILY_API_KEY"),
+                          get_secret("GROQ_MODEL", GROQ_MODEL), get_secret("GROQ_DRAFT_MODEL", GROQ_DRAFT_MODEL),
+                          float(get_secret("GROQ_RPM", GROQ_RPM)), float(get_secret("TAVILY_RPM", TAVILY_RPM)))
+    return InsightPipeline(clients, logger=logger, scrape_cache=get_scrape_cache(), insight_cache=get_insight_cache(),
+                           passage_index=get_passage_index(), document_cache=get_document_cache(),
+                           renderer=get_renderer(), metrics=get_metrics())
+
+# define the function that runs a report job
+def run_report_job(payload, progress):
+    """_summary_: Write the full report of a job on a worker thread, saving the partial text as it is written if the
+        request streams.
+        _params_: payload (dict): The inputs and settings of the request, and the ID of the session that sent it.
+            With stream set, the partial report is saved every JOB_PROGRESS_SECONDS for the page to show.
+        progress (callable): Stores the partial report for the page to show.
+    _returns_: dict: The result of generate_insights as a dictionary, with the timing spans of the request.
     """
-    # scrape the company website data and competitors data
-    company_data = scrape_website(inputs["company_url"])
-    competitors_data = []
-
-    # if competitors are provided, scrape the data for each competitor URL
-    if inputs["competitors"]:
-        competitors_data = [scrape_website(url.strip()) for url in inputs["competitors"].split(",") if url.strip()]
-
-    # generate insights based on the provided inputs and the scraped data
-    company_title = company_data.get("title", "")
-    company_description = company_data.get("description", "")
-
-    # define the prompt template for generating insights
-    prompt = f"""
-    You are a seasoned sales assistant. Based on the following details:
-    - **Company:** {{company_title}} ({{company_description}})
-    - Product Name: {{product_name}}
-    - Product Category: {{product_category}}
-    - Competitors Data: {{competitors_data}}
-    - Value Proposition: {{value_proposition}}
-    - Target Customer: {{target_customer}}
-
-    Product and Company Overview
-    * Generate a concise summary of the product and company, including key features, benefits, and unique selling points.
-    * Provide a recent news article or press release about the product or company to add current context.
-    Competitive Landscape
-    * compare the target product/product with the given competitors in terms of their offerings, highlighting strengths and weaknesses.
-    * Analyze the product's value proposition and differentiation factors using a SWOT (Strengths, Weaknesses, Opportunities, Threats) framework.
-    Target Customer Analysis
-    * Define the ideal customer persona, including demographics, psychographics, and behavioral characteristics.
-    * Identify key pain points of the target customer and explain how the product addresses each one.
-    * Develop a unique selling proposition (USP) that clearly communicates the product's value to the target customer.
-    Sales Strategy and Approach
-    * Recommend an ideal sales approach (e.g., consultative selling, solution selling) and explain why it's suitable for this product and target customer.
-    * Anticipate potential objections and provide concise, effective counterarguments for each.
-    * Identify the most effective sales channels for reaching the target customer and explain the rationale for each.
-    Sample Sales Pitch
-    * Generate a sample sales pitch paragraph incorporating the insights from the above analysis, ensure the sales pitch is:
-        - Attention-grabbing
-        - Solution presentation
-        - Product highlights and benefits
-        - Call to action
+    pipeline = build_pipeline(get_session_logger(payload["session_id"]))
+
+    def save_progress(chunks):
+        # the first chunk is saved right away, so the page shows it on its next poll
+        text, saved_at = "", float("-inf")
+        for chunk in chunks:
+            text += chunk
+            if time.monotonic() - saved_at >= JOB_PROGRESS_SECONDS:
+                progress(text)
+                saved_at = time.monotonic()
+        return text
+
+    trace = []
+    result = pipeline.generate_insights(payload["inputs"], payload["temperature"], payload["max_tokens"],
+                                        stream_handler=save_progress if payload.get("stream", True) else None,
+                                        use_cache=False, trace=trace, sectioned=payload["sectioned"])
+    return dict(result.as_dict(), timings=trace)
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    """_summary_: Open the report job queue and start its workers once per process."""
+    return JobQueue(run_report_job, workers=JOB_WORKERS)
+
+# define a function to store generated insights in the session
+def store_insights(record):
+    """_summary_: Show the errors of an insights request and keep its insights in the session state.
+        _params_: record (dict): The result of generate_insights, as returned by InsightResult.as_dict.
     """
+    for url, error in record["scrape_errors"].items():
+        st.error(f"Error accessing {url}: {error}")
+    if record["error"]:
+        st.error(f"Error generating insights: {record['error']}")
+    elif record["insights"]:
+        st.session_state["company_insights"] = record["insights"]
+        st.session_state["insights_from_cache"] = record["from_cache"]
+        st.session_state.logger.info("Insights generated and stored in session state")
 
-    try:
-        # generate insights using the LLM model and the provided inputs and the scraped data
-        prompt_template = ChatPromptTemplate.from_template(prompt)
-        # define the chain of tools to be used for generating insights
-        chain = prompt_template | llm | parser
-        # invoke the chain with the provided inputs and scraped data
-        insights = chain.invoke({
-            "company_title": company_title,
-            "company_description": company_description,
-            "product_name": inputs['product_name'],
-            "product_category": inputs['product_category'],
-            "competitors_data": str(competitors_data),
-            "value_proposition": inputs['value_proposition'],
-            "target_customer": inputs['target_customer']
-        })
-        
-        # Log the generated insights
-        st.session_state.logger.info(f"Generated Insights:\n{insights}")
-        
-        return insights
-    # if an exception occurs during the generation process, log the error and return None
-    except Exception as e:
-        st.error(f"Error generating insights: {str(e)}")
-        st.session_state.logger.error(f"Error generating insights: {str(e)}")
-        return None
-
-# define the generate_pdf function
-def generate_pdf(content, filename="Account_Insights.pdf"):
-    """_summary_: Generate a PDF file with the provided content.
-        _params_: content (str): The content to be included in the PDF file.
-        filename (str): The filename for the generated PDF file.
-    _returns_: str: The filename of the generated PDF file, or None if an error occurs.
+# define a fragment that shows the report job until it is finished
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_report_job(job_id):
+    """_summary_: Show the partial report, or the draft, of a running job, and rerun the page once it finishes.
+        _params_: job_id (str): The ID of the report job.
     """
-    try:
-        # create a PDF file with the provided content
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=10)
-        # set the space between lines = 10
-        pdf.multi_cell(0, 10, content)
-        pdf.output(filename)
-        st.session_state.logger.info(f"Successfully generated PDF: {filename}")
-        return filename
-    except Exception as e:
-        st.error(f"Error generating PDF: {str(e)}")
-        st.session_state.logger.error(f"Error generating PDF: {str(e)}")
-        return None
+    job = get_job_queue().get(job_id)
+    if job is None or job["status"] in (DONE, FAILED):
+        st.rerun()
+    if job["progress"]:
+        st.markdown(job["progress"])
+        st.caption("Writing the full report...")
+        return
+    if st.session_state.get("draft_insights"):
+        st.markdown(st.session_state["draft_insights"])
+        st.caption("This is a quick draft. The full report replaces it as soon as it is written.")
+    if job["status"] == QUEUED:
+        st.caption(f"Waiting for a free report writer ({job['position']} in line)...")
+    elif not st.session_state.get("draft_insights"):
+        st.caption("Writing the full report...")
+
+# define a function to set up session logging
+def setup_session_logging():
+    """
+    _summary_: Set up logging for the current session. Creates a logger that stamps messages with the session ID
+        and writes them through the shared background log writer.
+    """
+    if 'logger' not in st.session_state:
+        # Create a logger object for the current session, the suffix keeps sessions started in the same second apart
+        session_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        # Store the logger in the session state object
+        st.session_state.logger = get_session_logger(session_id)
 
 # define the main function to be called when the page is loaded and run the application
 def main():
     # Set up session logging
     setup_session_logging()
 
-    # Initialize LLM and search tools
-    global llm, search
-    llm = ChatGroq(api_key=st.secrets["GROQ_API_KEY"])
-    search = TavilySearchResults(api_key=st.secrets["TAVILY_API_KEY"], max_results=2)
+    # Get the shared LLM and search tools, and build the pipeline that uses them with the session logger
+    pipeline = build_pipeline(st.session_state.logger)
+    scrape_cache = pipeline.scrape_cache
 
     # Add a success message container that can be conditionally displayed
     reset_success_placeholder = st.empty()
@@ -224,6 +231,26 @@ def main():
     st.sidebar.title("LLM Settings")
     temperature = st.sidebar.slider("Temperature", min_value=0.0, max_value=1.0, value=0.7, step=0.1)
     max_tokens = st.sidebar.slider("Max Tokens", min_value=100, max_value=2000, value=500, step=100)
+    stream_output = st.sidebar.toggle("Stream output", value=True,
+                                      help="Show the draft as it is written, and the full report about every second "
+                                           "while it is written, instead of waiting for each to finish.")
+    fast_draft = st.sidebar.toggle("Fast draft first", value=True,
+                                   help="Show a short draft from a small, fast model while the full report is written.")
+    sectioned = st.sidebar.toggle("Parallel sections", value=False,
+                                  help="Write each section of the report in its own request, all at the same time.")
+    if sectioned and max_tokens < SECTIONED_MIN_TOKENS:
+        st.sidebar.caption(f"Parallel sections need at least {SECTIONED_MIN_TOKENS} max tokens, "
+                           "the report is written in one request.")
+    force_refresh = st.sidebar.checkbox("Force refresh", value=False,
+                                        help="Regenerate the insights even if the same request was answered before.")
+
+    # Show how often website lookups are served from the cache
+    cache_stats = scrape_cache.stats()
+    st.sidebar.caption(f"Search cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                       f"{cache_stats['entries']} sites stored")
+
+    # inputs of a new form submission, the insights are generated below the form
+    inputs = None
 
     # Streamlit form
     with st.form("company_info", clear_on_submit=True):
@@ -258,28 +285,14 @@ def main():
                     st.session_state.logger.info(f"Competitors: {competitors}")
                     st.session_state.logger.info(f"Value Proposition: {value_proposition}")
                     st.session_state.logger.info(f"Target Customer: {target_customer}")
-                    
-                    # Generate insights based on the form inputs, include a spinner to show the results is being generated
-                    with st.spinner("Processing..."):
-                        inputs = {
-                            "product_name": product_name,
-                            "company_url": company_url,
-                            "product_category": product_category,
-                            "competitors": competitors,
-                            "value_proposition": value_proposition,
-                            "target_customer": target_customer,
-                        }
-                        # if an uploaded file is provided, parse the content of the file
-                        if uploaded_file:
-                            file_content = parse_uploaded_file(uploaded_file)
-                            if file_content:
-                                inputs["uploaded_file"] = file_content
-                                st.session_state.logger.info(f"Uploaded file parsed: {uploaded_file.name}")
-                        # generate insights based on the provided inputs
-                        company_insights = generate_insights(inputs, temperature, max_tokens)
-                        if company_insights:
-                            st.session_state["company_insights"] = company_insights
-                            st.session_state.logger.info("Insights generated and stored in session state")
+                    inputs = {
+                        "product_name": product_name,
+                        "company_url": company_url,
+                        "product_category": product_category,
+                        "competitors": competitors,
+                        "value_proposition": value_proposition,
+                        "target_customer": target_customer,
+                    }
                 else:
                     # if the form is submitted without the required fields, show a warning message
                     st.warning("Please provide at least a product name and company URL.")
@@ -288,6 +301,7 @@ def main():
         with col2:
             if st.form_submit_button("Reset Application"):
                 st.session_state.clear()
+                st.query_params.clear()
                 setup_session_logging()  # Reinitialize the logger
                 
                 # Display success message
@@ -297,23 +311,110 @@ def main():
                 time.sleep(3)  # Wait for 3 seconds
                 st.rerun()
 
+    # Generate insights for a new submission, include a spinner to show the results is being generated
+    draft_area = None
+    if inputs or "company_insights" in st.session_state or st.query_params.get("job"):
+        st.subheader("Generated Insights")
+    if inputs:
+        # timing spans of every stage of this request, shown in the sidebar
+        trace = []
+        with st.spinner("Processing..."):
+            # if an uploaded file is provided, parse the content of the file
+            if uploaded_file:
+                document = pipeline.parse_uploaded_file(uploaded_file, trace=trace)
+                if document.error:
+                    st.error(f"Error parsing file: {document.error}")
+                elif document.sha256:
+                    # indexed documents have no content, their passages are retrieved when generating
+                    if document.content:
+                        inputs["uploaded_file"] = document.content
+                    inputs["uploaded_file_hash"] = document.sha256
+                    st.session_state.logger.info(f"Uploaded file parsed: {uploaded_file.name}")
+            st.session_state["timings"] = trace
+            st.session_state.pop("company_insights", None)
+            st.session_state.pop("draft_insights", None)
+            # identical requests are served from the insight cache, unless a refresh is forced
+            cached = None if force_refresh else pipeline.cached_insights(inputs, temperature, max_tokens,
+                                                                          sectioned)
+            if cached:
+                st.query_params.pop("job", None)
+                store_insights(cached.as_dict())
+            else:
+                # the full report is written by a background job, which the page follows by its ID, also in the
+                # URL so the report is found again after a reload
+                job_id = get_job_queue().submit({
+                    "inputs": inputs,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "sectioned": sectioned,
+                    "stream": stream_output,
+                    "session_id": st.session_state.logger.extra["session_id"],
+                })
+                st.query_params["job"] = job_id
+                st.session_state.logger.info(f"Report job submitted: {job_id}")
+                if fast_draft:
+                    # show a short draft from the fast model while the report is written
+                    draft_area = st.empty()
+                    with draft_area.container():
+                        draft = pipeline.generate_draft(inputs, temperature, max_tokens,
+                                                        stream_handler=st.write_stream if stream_output else None,
+                                                        trace=trace)
+                    if draft.error:
+                        st.error(f"Error generating draft: {draft.error}")
+                    st.session_state["draft_insights"] = draft.insights
+
+    # Follow the report job of this page until it is finished
+    job_id = st.query_params.get("job")
+    if draft_area:
+        # the draft is shown by the job fragment from now on
+        draft_area.empty()
+    if job_id and st.session_state.get("finished_job") != job_id:
+        job = get_job_queue().get(job_id)
+        if job is None:
+            st.query_params.pop("job", None)
+        elif job["status"] in (DONE, FAILED):
+            st.session_state["finished_job"] = job_id
+            st.session_state.pop("draft_insights", None)
+            record = job["result"] or {"insights": None, "error": job["error"], "from_cache": False,
+                                       "scrape_errors": {}}
+            store_insights(record)
+            st.session_state["timings"] = st.session_state.get("timings", []) + record.get("timings", [])
+        else:
+            show_report_job(job_id)
+
     # Display insights and download option
     if "company_insights" in st.session_state:
-        st.subheader("Generated Insights")
+        if st.session_state.get("insights_from_cache"):
+            st.caption("Served from cache. Tick \"Force refresh\" in the sidebar to regenerate.")
         st.markdown(st.session_state["company_insights"])
 
-        # Add a download button for the insights as a PDF file
-        pdf_file = generate_pdf(st.session_state["company_insights"])
-        if pdf_file:
-            with open(pdf_file, "rb") as pdf:
-                st.download_button(
-                    label="Download Insights as PDF",
-                    data=pdf,
-                    # set the filename to include the product name and the date and time of download
-                    file_name=f"{product_name}_Insights_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                    mime="application/pdf",
-                )
-            st.session_state.logger.info("PDF generated and download button displayed")
+        # Add download buttons for the insights as PDF, Word and HTML files
+        # a report is only built when its button is clicked, and reused for the same insights
+        company_insights = st.session_state["company_insights"]
+        # set the filename to include the product name and the date and time of download
+        file_stem = f"{product_name}_Insights_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        for column, (report_format, label) in zip(st.columns(3), (("pdf", "PDF"), ("docx", "Word"),
+                                                                    ("html", "HTML"))):
+            mime_type, extension = REPORT_FORMATS[report_format]
+            column.download_button(
+                label=f"Download Insights as {label}",
+                data=lambda report_format=report_format: get_report(company_insights, report_format, pipeline),
+                file_name=f"{file_stem}{extension}",
+                mime=mime_type,
+                on_click="ignore",
+            )
+        st.session_state.logger.info("PDF download button displayed")
+
+    # Show where the time of the last request went
+    if st.session_state.get("timings"):
+        with st.sidebar.expander("Timings of the last request"):
+            st.dataframe([{
+                "stage": span["stage"],
+                "seconds": span["duration"],
+                "status": span["status"],
+                "detail": span.get("url") or span.get("file") or "",
+                "tokens": (span.get("input_tokens") or 0) + (span.get("output_tokens") or 0) or None,
+            } for span in st.session_state["timings"]], hide_index=True)
     st.session_state.logger.info("Application session ended")
     # insert a space after the session end
     st.markdown("<br>", unsafe_allow_html=True)
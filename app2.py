@@ -3,13 +3,14 @@ from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.tools.tavily_search import TavilySearchResults
-from fpdf import FPDF
-import PyPDF2
-import docx
-import logging
+from documents import PDF_MIME_TYPE, SUPPORTED_MIME_TYPES, iter_pages
+from reports import ReportRenderer
+from result_cache import DocumentCache
+from session_logging import get_session_logger
+import hashlib
 from datetime import datetime
-import os
 import time
+import uuid
 
 # Initialize LLM and search tools
 llm = ChatGroq(api_key=st.secrets["groq_api_key"])
@@ -19,16 +20,10 @@ parser = StrOutputParser()
 
 def setup_session_logging():
     if 'logger' not in st.session_state:
-        session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_dir = "session_logs"
-        os.makedirs(log_dir, exist_ok=True)
-        logger = logging.getLogger(f"session_{session_id}")
-        logger.setLevel(logging.INFO)
-        file_handler = logging.FileHandler(f"{log_dir}/session_{session_id}.log")
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        st.session_state.logger = logger
+        # all sessions write through the shared background log writer, the suffix keeps sessions started
+        # in the same second apart
+        session_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        st.session_state.logger = get_session_logger(session_id)
 
 def scrape_website(url):
     try:
@@ -48,20 +43,27 @@ def scrape_website(url):
         st.session_state.logger.error(f"Error scraping website {url}: {str(e)}")
         return {"title": "Error", "description": f"Error scraping website: {str(e)}"}
 
+@st.cache_resource(show_spinner=False)
+def get_document_cache():
+    return DocumentCache()
+
 def parse_uploaded_file(file):
     try:
-        if file.type == "application/pdf":
-            reader = PyPDF2.PdfReader(file)
-            content = " ".join([page.extract_text() for page in reader.pages])
-            st.session_state.logger.info(f"Successfully parsed PDF file: {file.name}")
-            return content
-        elif file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            doc = docx.Document(file)
-            content = " ".join([paragraph.text for paragraph in doc.paragraphs])
-            st.session_state.logger.info(f"Successfully parsed DOCX file: {file.name}")
-            return content
-        st.session_state.logger.warning(f"Unsupported file type: {file.type}")
-        return None
+        if file.type not in SUPPORTED_MIME_TYPES:
+            st.session_state.logger.warning(f"Unsupported file type: {file.type}")
+            return None
+        # the pages of a file parsed before are read from the cache, large PDFs are extracted in parallel
+        document_cache = get_document_cache()
+        sha256 = hashlib.sha256(file.getvalue()).hexdigest()
+        pages = document_cache.get(sha256)
+        if pages is None:
+            pages = list(iter_pages(file, file.type))
+            if sum(len(page) for page in pages) <= document_cache.max_document_chars:
+                document_cache.set(sha256, pages)
+        content = " ".join(pages)
+        file_kind = "PDF" if file.type == PDF_MIME_TYPE else "DOCX"
+        st.session_state.logger.info(f"Successfully parsed {file_kind} file: {file.name}")
+        return content
     except Exception as e:
         st.error(f"Error parsing file: {str(e)}")
         st.session_state.logger.error(f"Error parsing file {file.name}: {str(e)}")
@@ -116,36 +118,38 @@ def generate_insights(inputs, temperature, max_tokens):
         return None
     
 def summarize_insights(company_insights):
-    prompt = f"Summarize the following detailed content into a concise summary:\n\n{company_insights}"
-    summarized_response = llm.invoke(prompt)
-    return summarized_response
+    prompt_template = ChatPromptTemplate.from_template(
+        "Summarize the following detailed content into a concise summary:\n\n{content}")
+    chain = prompt_template | llm | parser
+    return chain.invoke({"content": company_insights})
 
-def generate_pdf(content, filename="Account_Insights.pdf"):
+def get_insights_summary(company_insights):
+    # the summary is kept in session state with the hash of its report, so reruns reuse it instead of
+    # summarizing the same report again
+    report_hash = hashlib.sha256(company_insights.encode("utf-8")).hexdigest()
+    summary = st.session_state.get("insights_summary")
+    if summary and summary["report_hash"] == report_hash:
+        return summary
+    summary = {"report_hash": report_hash, "summary": None, "pdf": None}
     try:
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        effective_page_width = pdf.w - 2*pdf.l_margin
-        pdf.set_auto_page_break(auto=True, margin=15)
-        
-        # Add a title for the summary
-        pdf.set_font('Arial', 'B', 16)
-        pdf.cell(effective_page_width, 10, 'Sales Insights Summary', 0, 1, 'C')
-        
-        pdf.ln(10)  # Add a line space
-        
-        # Set the font back for content
-        pdf.set_font("Arial", size=10)
-        
-        # Insert the content
-        content = content.replace('\n', ' ')
-        content = ' '.join(content.split())  # Ensure single spacing by removing extra spaces
-        pdf.multi_cell(effective_page_width, 10, content)
-        
-        # Save PDF to a file
-        pdf.output(filename)
-        
-        return filename
+        summary["summary"] = summarize_insights(company_insights)
+        st.session_state.logger.info("Insights summarized and stored in session state")
+    except Exception as e:
+        # failures are kept too, so a rerun does not pay for another attempt on the same report
+        st.error(f"Error summarizing insights: {str(e)}")
+        st.session_state.logger.error(f"Error summarizing insights: {str(e)}")
+    st.session_state["insights_summary"] = summary
+    return summary
+
+@st.cache_resource(show_spinner=False)
+def get_renderer():
+    return ReportRenderer()
+
+def generate_pdf(content):
+    try:
+        # the renderer keeps the headings and lists of the summary, and reuses the PDF of a summary it rendered before;
+        # the bytes stay in the session instead of a file on disk that every session would share
+        return get_renderer().render(content, "pdf", title="Sales Insights Summary")
     except Exception as e:
         st.error(f"Error generating PDF: {str(e)}")
         return None
@@ -219,6 +223,8 @@ def main():
                         if company_insights:
                             st.session_state["company_insights"] = company_insights
                             st.session_state.logger.info("Insights generated and stored in session state")
+                            # summarize the report once, right after it is generated
+                            get_insights_summary(company_insights)
                 else:
                     st.warning("Please provide at least a product name and company URL.")
                     st.session_state.logger.warning("Incomplete form submission: missing product name or company URL")
@@ -239,17 +245,17 @@ def main():
         st.subheader("Generated Insights")
         st.markdown(st.session_state["company_insights"])  # Ensure to convert newlines to spaces for single-spaced display
 
-        summarized_insights = summarize_insights(company_insights)
-        pdf_file = generate_pdf(summarized_insights)
-        # pdf_file = generate_pdf(st.session_state["company_insights"])
-        if pdf_file:
-            with open(pdf_file, "rb") as pdf:
-                st.download_button(
-                    label="Download Insights as PDF",
-                    data=pdf,
-                    file_name=pdf_file,
-                    mime="application/pdf"
-                )
+        # reuse the summary of this report, and its PDF once it is built
+        summary = get_insights_summary(st.session_state["company_insights"])
+        if summary["summary"] and not summary["pdf"]:
+            summary["pdf"] = generate_pdf(summary["summary"])
+        if summary["pdf"]:
+            st.download_button(
+                label="Download Insights as PDF",
+                data=summary["pdf"],
+                file_name="Account_Insights.pdf",
+                mime="application/pdf"
+            )
             st.session_state.logger.info("PDF generated and download button displayed")
 
     st.session_state.logger.info("Application session ended")
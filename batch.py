@@ -0,0 +1,233 @@
+# import necessary libraries
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline import GROQ_MODEL, Clients, InsightPipeline
+from reports import REPORT_FORMATS
+from result_cache import DocumentCache, ScrapeCache, InsightCache, fingerprint
+from retrieval import PassageIndex
+
+# columns read from each account row
+ACCOUNT_FIELDS = ["product_name", "company_url", "product_category", "competitors", "value_proposition", "target_customer"]
+
+logger = logging.getLogger("sales_aipe.batch")
+
+
+# define the LocalFile class
+class LocalFile(io.BytesIO):
+    """_summary_: In-memory copy of a document on disk that looks like a Streamlit UploadedFile to parse_uploaded_file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+        self.type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+# define the read_accounts function
+def read_accounts(path):
+    """_summary_: Read the accounts to process from a JSONL or CSV file.
+        _params_: path (str): The path of the .jsonl or .csv file, one account per line or row.
+    _returns_: list: One dictionary per account with the form fields, plus the optional "id" and "document" keys.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    accounts = []
+    for row in rows:
+        account = {field: (row.get(field) or "").strip() for field in ACCOUNT_FIELDS}
+        account["id"] = (row.get("id") or "").strip()
+        account["document"] = (row.get("document") or "").strip()
+        accounts.append(account)
+    return accounts
+
+
+# define the account_key function
+def account_key(account, temperature, max_tokens, model_name):
+    """_summary_: Build the file name stem used for the outputs of an account.
+        _params_: account (dict): The account, as returned by read_accounts.
+        temperature (float): The temperature parameter for the LLM model.
+        max_tokens (int): The maximum number of tokens to generate.
+        model_name (str): The Groq model that writes the insights, so a new model does not skip finished accounts.
+    _returns_: str: A file-system safe name, stable across runs for the same account, document and settings.
+    """
+    # hash the document bytes rather than its parsed text, so finished accounts are found without parsing
+    document_hash = None
+    if account["document"]:
+        with open(account["document"], "rb") as f:
+            document_hash = hashlib.sha256(f.read()).hexdigest()
+    digest = fingerprint({field: account[field] for field in ACCOUNT_FIELDS}, document_hash, temperature, max_tokens,
+                         model_name)
+    label = account["id"] or f"{account['product_name']}_{account['company_url']}"
+    label = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")[:60] or "account"
+    return f"{label}_{digest[:12]}"
+
+
+# define the llm_model_name function
+def llm_model_name(clients):
+    """_summary_: Return the name of the model that writes the insights, as the insight cache records it."""
+    return getattr(clients.llm, "model_name", None)
+
+
+# define the process_account function
+def process_account(pipeline, account, output_dir, temperature, max_tokens, force=False, formats=("pdf",)):
+    """_summary_: Generate the insights (and PDF) of one account and write them to the output directory.
+        _params_: pipeline (InsightPipeline): The pipeline used to generate the insights.
+        account (dict): The account, as returned by read_accounts.
+        output_dir (str): The directory the result files are written to.
+        temperature (float): The temperature parameter for the LLM model.
+        max_tokens (int): The maximum number of tokens to generate.
+        force (bool): Whether to regenerate the insights even if they are in the insight cache.
+        formats (tuple): The formats the insights are exported in, among "pdf", "docx" and "html".
+    _returns_: dict: The result record that was written, with a "status" of "ok" or "error".
+    """
+    start = time.time()
+    key = account_key(account, temperature, max_tokens, llm_model_name(pipeline.clients))
+    result_path = os.path.join(output_dir, f"{key}.json")
+    record = {"key": key, "account": account, "status": "ok", "error": None, "pdf": None, "reports": {}}
+
+    inputs = {field: account[field] for field in ACCOUNT_FIELDS}
+    if account["document"]:
+        document = pipeline.parse_uploaded_file(LocalFile(account["document"]))
+        if document.sha256:
+            if document.content:
+                inputs["uploaded_file"] = document.content
+            inputs["uploaded_file_hash"] = document.sha256
+
+    # identical accounts are served from the insight cache, unless a refresh is forced
+    result = pipeline.generate_insights(inputs, temperature, max_tokens, use_cache=not force)
+    record.update(fingerprint=result.fingerprint, from_cache=result.from_cache, insights=result.insights,
+                  scrape_errors={scrape.url: scrape.error for scrape in result.scrape_errors})
+    if result.error or not result.insights:
+        record.update(status="error", error=result.error or "No insights generated")
+    else:
+        # the insights are parsed once by the renderer and laid out in each format from there
+        for report_format in formats:
+            extension = REPORT_FORMATS[report_format][1]
+            report = pipeline.generate_report(result.insights, report_format,
+                                              filename=os.path.join(output_dir, f"{key}{extension}"))
+            record["reports"][report_format] = report.filename
+            if report.error:
+                record.update(status="error", error=f"Error generating {report_format.upper()}: {report.error}")
+        record["pdf"] = record["reports"].get("pdf")
+    record["elapsed"] = round(time.time() - start, 3)
+
+    # write through a temporary file so an interrupted run never leaves a half-written result
+    with open(f"{result_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+    os.replace(f"{result_path}.tmp", result_path)
+    return record
+
+
+# define the is_finished function
+def is_finished(account, output_dir, temperature, max_tokens, model_name):
+    """_summary_: Check whether an earlier run already wrote a successful result for an account.
+        _params_: account (dict): The account, as returned by read_accounts.
+        output_dir (str): The directory the result files are written to.
+        temperature (float): The temperature parameter for the LLM model.
+        max_tokens (int): The maximum number of tokens to generate.
+        model_name (str): The Groq model that writes the insights.
+    _returns_: bool: True if the account can be skipped.
+    """
+    try:
+        result_path = os.path.join(output_dir, f"{account_key(account, temperature, max_tokens, model_name)}.json")
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f).get("status") == "ok"
+    except (OSError, ValueError):
+        return False
+
+
+# define the run_batch function
+def run_batch(clients, accounts, output_dir, workers=4, groq_rpm=30, tavily_rpm=60, temperature=0.7, max_tokens=500,
+              force=False, formats=("pdf",)):
+    """_summary_: Process accounts on a bounded worker pool, rate limiting the Groq and Tavily calls.
+        _params_: clients (Clients): The LLM and search clients, shared by all workers, as built by Clients.from_keys.
+        accounts (list): The accounts, as returned by read_accounts.
+        output_dir (str): The directory the result files are written to.
+        workers (int): The number of accounts processed at the same time.
+        groq_rpm (float): The maximum number of Groq requests per minute.
+        tavily_rpm (float): The maximum number of Tavily requests per minute.
+        temperature (float): The temperature parameter for the LLM model.
+        max_tokens (int): The maximum number of tokens to generate.
+        force (bool): Whether to reprocess accounts that already finished.
+        formats (tuple): The formats the insights are exported in, among "pdf", "docx" and "html".
+    _returns_: dict: The number of accounts that succeeded, failed and were skipped.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # the backend policies are shared by all workers, so the whole batch stays within the rates
+    clients.llm_backend.set_rate(groq_rpm)
+    clients.search_backend.set_rate(tavily_rpm)
+    pipeline = InsightPipeline(clients, logger=logger, scrape_cache=ScrapeCache(), insight_cache=InsightCache(),
+                               passage_index=PassageIndex(), document_cache=DocumentCache())
+
+    summary = {"ok": 0, "error": 0, "skipped": 0}
+    pending = []
+    for account in accounts:
+        if not force and is_finished(account, output_dir, temperature, max_tokens, llm_model_name(clients)):
+            summary["skipped"] += 1
+        else:
+            pending.append(account)
+    logger.info(f"Processing {len(pending)} accounts, skipping {summary['skipped']} already finished")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_account, pipeline, account, output_dir, temperature, max_tokens, force,
+                                   formats):
+                   account
+                   for account in pending}
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                logger.error(f"Error processing account {account['product_name']} / {account['company_url']}: {e}")
+                summary["error"] += 1
+                continue
+            summary[record["status"]] += 1
+            logger.info(f"[{sum(summary.values())}/{len(accounts)}] {record['key']}: {record['status']} "
+                        f"in {record['elapsed']}s{' (cached)' if record['from_cache'] else ''}")
+    return summary
+
+
+# define the main function for the command line
+def main():
+    arg_parser = argparse.ArgumentParser(description="Generate sales insights for a JSONL or CSV file of accounts.")
+    arg_parser.add_argument("accounts", help="JSONL or CSV file with one account per line or row")
+    arg_parser.add_argument("-o", "--output-dir", default="batch_output", help="directory for the results and PDFs")
+    arg_parser.add_argument("-w", "--workers", type=int, default=4, help="number of accounts processed at the same time")
+    arg_parser.add_argument("--groq-rpm", type=float, default=30, help="maximum Groq requests per minute")
+    arg_parser.add_argument("--tavily-rpm", type=float, default=60, help="maximum Tavily requests per minute")
+    arg_parser.add_argument("--temperature", type=float, default=0.7, help="temperature of the LLM model")
+    arg_parser.add_argument("--max-tokens", type=int, default=500, help="maximum number of tokens to generate")
+    arg_parser.add_argument("--force", action="store_true", help="reprocess accounts that already finished")
+    arg_parser.add_argument("--formats", default="pdf",
+                            help="comma-separated report formats written for each account: pdf, docx, html")
+    arg_parser.add_argument("--no-pdf", action="store_true", help="skip writing any report for each account")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    formats = tuple(report_format.strip() for report_format in args.formats.split(",") if report_format.strip())
+    unknown = set(formats) - set(REPORT_FORMATS)
+    if unknown:
+        arg_parser.error(f"unsupported report formats: {', '.join(sorted(unknown))}")
+    clients = Clients.from_keys(os.environ["GROQ_API_KEY"], os.environ["TAVILY_API_KEY"],
+                                model_name=os.environ.get("GROQ_MODEL", GROQ_MODEL))
+    accounts = read_accounts(args.accounts)
+    summary = run_batch(clients, accounts, args.output_dir, workers=args.workers, groq_rpm=args.groq_rpm,
+                        tavily_rpm=args.tavily_rpm, temperature=args.temperature, max_tokens=args.max_tokens,
+                        force=args.force, formats=() if args.no_pdf else formats)
+    logger.info(f"Done: {summary['ok']} succeeded, {summary['error']} failed, {summary['skipped']} skipped")
+
+
+if __name__ == "__main__":
+    main()
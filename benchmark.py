@@ -0,0 +1,294 @@
+# import necessary libraries
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from batch import ACCOUNT_FIELDS, LocalFile, read_accounts
+from documents import CHARS_PER_TOKEN, estimate_tokens
+from log_index import read_session_logs
+from metrics import percentile
+from pipeline import SECTIONED_MIN_TOKENS, Clients, InsightPipeline
+from reports import ReportRenderer
+
+# documents bundled with the repository, parsed by the parse_uploaded_file benchmark
+BUNDLED_DOCUMENTS = ["applewatch.pdf", "applewatch.docx", "fitbit.docx"]
+
+# used when no insights were recorded in the session logs
+DEFAULT_RESPONSE = """Product and Company Overview
+---------------
+{product_name} is sold by {company_url} to {target_customer}.
+
+Competitive Landscape
+-------------------
+* {competitors}
+
+SWOT Analysis
+-------------
+* Strength: {value_proposition}
+
+Key Decision Makers
+-------------------
+* Not available
+"""
+
+# define the StubBackendError class
+class StubBackendError(RuntimeError):
+    """_summary_: Simulated failure of a stub backend, a server error that is worth retrying."""
+    status_code = 503
+
+
+# define the StubChatModel class
+class StubChatModel(BaseChatModel):
+    """_summary_: Stand-in for ChatGroq that replays recorded responses after a configurable delay.
+        Responses are returned in turn, cut to the requested max tokens, written word by word, and a share of
+        the calls fails.
+    """
+    responses: list
+    latency: float = 0.5  # seconds before the first token
+    token_latency: float = 0.0  # seconds between streamed tokens
+    failure_rate: float = 0.0
+    seed: int = None
+
+    _lock = PrivateAttr(default_factory=threading.Lock)
+    _random = PrivateAttr()
+    _calls = PrivateAttr(default=0)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _respond(self, messages, max_tokens=None):
+        """_summary_: Wait for the configured latency, then pick the next response or fail.
+            _params_: messages (list): The prompt messages.
+            max_tokens (int): The maximum number of tokens of the response, as bound by the pipeline.
+        _returns_: tuple: The response text and its usage metadata.
+        """
+        with self._lock:
+            response = self.responses[self._calls % len(self.responses)]
+            self._calls += 1
+            failed = self._random.random() < self.failure_rate
+        time.sleep(self.latency)
+        if failed:
+            raise StubBackendError("Simulated LLM failure")
+        if max_tokens:
+            response = response[:max_tokens * CHARS_PER_TOKEN]
+        input_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        output_tokens = estimate_tokens(response)
+        usage = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                 "total_tokens": input_tokens + output_tokens}
+        return response, usage
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._respond(messages, kwargs.get("max_tokens"))
+        # a blocking call takes as long as writing every token
+        time.sleep(self.token_latency * len(re.findall(r"\S+\s*|\s+", text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._respond(messages, kwargs.get("max_tokens"))
+        for token in re.findall(r"\S+\s*|\s+", text):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+            time.sleep(self.token_latency)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+# define the StubSearch class
+class StubSearch:
+    """_summary_: Stand-in for TavilySearchResults that answers every query after a configurable delay."""
+
+    def __init__(self, latency=0.2, failure_rate=0.0, content_chars=800, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.content_chars = content_chars
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def invoke(self, query):
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        time.sleep(self.latency)
+        if failed:
+            raise StubBackendError("Simulated search failure")
+        url = query.split()[-1]
+        content = f"{url} summary. " * (self.content_chars // (len(url) + 10) + 1)
+        return [{"url": url, "title": url, "content": content[:self.content_chars]}]
+
+
+# define the measure function
+def measure(name, func, items, concurrency=1):
+    """_summary_: Run a benchmark scenario and summarize its latency, throughput and peak memory.
+        _params_: name (str): The name of the scenario.
+        func (callable): The operation to measure, called with each item. It returns an error (or None).
+        items (list): The inputs of the operation.
+        concurrency (int): The number of operations run at the same time.
+    _returns_: dict: The scenario results, with latencies in seconds and peak memory in MB.
+    """
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            error = func(item)
+        except Exception as e:
+            error = str(e)
+        return time.perf_counter() - start, error
+
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(timed, items))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in runs]
+    return {
+        "scenario": name,
+        "runs": len(runs),
+        "errors": sum(1 for _, error in runs if error),
+        "p50": round(percentile(latencies, 0.5), 4) if runs else None,
+        "p95": round(percentile(latencies, 0.95), 4) if runs else None,
+        "throughput": round(len(runs) / elapsed, 3) if elapsed else None,
+        "peak_memory_mb": round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2),
+    }
+
+
+# define the run_benchmark function
+def run_benchmark(payloads, responses, documents, iterations=3, concurrency=4, llm_latency=0.5, token_latency=0.0,
+                  search_latency=0.2, failure_rate=0.0, stream=False, sectioned=False, max_tokens=500, seed=0):
+    """_summary_: Benchmark parse_uploaded_file, generate_insights and generate_pdf against stub backends.
+        No caches are used, so every run does the full work.
+        _params_: payloads (list): The form inputs replayed by the generate_insights scenario.
+        responses (list): The insights the stub LLM answers with, also rendered by the generate_pdf scenario.
+        documents (list): The paths of the documents parsed by the parse_uploaded_file scenario.
+        iterations (int): The number of times each payload, document and response is replayed.
+        concurrency (int): The number of requests run at the same time.
+        llm_latency (float): The seconds the stub LLM waits before answering.
+        token_latency (float): The seconds the stub LLM waits between streamed tokens.
+        search_latency (float): The seconds the stub search waits before answering.
+        failure_rate (float): The share of stub LLM and search calls that fail.
+        stream (bool): Whether generate_insights streams the LLM output.
+        sectioned (bool): Whether generate_insights writes each section of the report in its own LLM call.
+        max_tokens (int): The max tokens setting of generate_insights, at least SECTIONED_MIN_TOKENS for sectioned
+            reports to be written section by section.
+        seed (int): The seed of the simulated failures.
+    _returns_: list: The results of each scenario, as returned by measure.
+    """
+    llm = StubChatModel(responses=responses, latency=llm_latency, token_latency=token_latency,
+                        failure_rate=failure_rate, seed=seed)
+    search = StubSearch(latency=search_latency, failure_rate=failure_rate, seed=seed)
+    # a renderer without its cache, so the report scenarios render every time
+    pipeline = InsightPipeline(Clients(llm=llm, search=search), renderer=ReportRenderer(max_entries=0))
+    stream_handler = (lambda chunks: "".join(chunks)) if stream else None
+
+    def parse(path):
+        return pipeline.parse_uploaded_file(LocalFile(path)).error
+
+    def generate(inputs):
+        return pipeline.generate_insights(dict(inputs), 0.7, max_tokens, stream_handler=stream_handler,
+                                          use_cache=False, sectioned=sectioned).error
+
+    def render(insights):
+        return pipeline.generate_pdf(insights).error
+
+    tracemalloc.start()
+    try:
+        return [
+            measure("parse_uploaded_file", parse, documents * iterations, concurrency),
+            measure("generate_insights", generate, payloads * iterations, concurrency),
+            measure("generate_pdf", render, responses * iterations, concurrency),
+        ]
+    finally:
+        tracemalloc.stop()
+
+
+# define the compare function
+def compare(results, baseline, tolerance):
+    """_summary_: Find the scenarios whose p95 latency or throughput regressed against a baseline run.
+        _params_: results (list): The results of this run.
+        baseline (list): The results of the baseline run, as written with --json.
+        tolerance (float): The allowed relative regression, e.g. 0.2 for 20%.
+    _returns_: list: A message per regression.
+    """
+    regressions = []
+    baseline = {result["scenario"]: result for result in baseline}
+    for result in results:
+        before = baseline.get(result["scenario"])
+        if not before or not result["runs"]:
+            continue
+        if before["p95"] and result["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: p95 {before['p95']}s -> {result['p95']}s")
+        if before["throughput"] and result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: throughput {before['throughput']}/s -> "
+                               f"{result['throughput']}/s")
+    return regressions
+
+
+# define the main function for the command line
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the insight pipeline offline, against stub Groq and "
+                                                     "Tavily backends that replay the recorded sessions.")
+    arg_parser.add_argument("--log-dir", default="session_logs", help="directory of the session logs to replay")
+    arg_parser.add_argument("--payloads", help="JSONL or CSV file of extra form inputs, in the batch accounts format")
+    arg_parser.add_argument("--documents", nargs="*", default=BUNDLED_DOCUMENTS, help="documents to parse")
+    arg_parser.add_argument("-n", "--iterations", type=int, default=3, help="times each payload is replayed")
+    arg_parser.add_argument("-c", "--concurrency", type=int, default=4, help="requests run at the same time")
+    arg_parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before the stub LLM answers")
+    arg_parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed tokens")
+    arg_parser.add_argument("--search-latency", type=float, default=0.2, help="seconds before the stub search answers")
+    arg_parser.add_argument("--failure-rate", type=float, default=0.0, help="share of stub backend calls that fail")
+    arg_parser.add_argument("--stream", action="store_true", help="stream the LLM output")
+    arg_parser.add_argument("--sectioned", action="store_true", help="write each report section in its own LLM call")
+    arg_parser.add_argument("--max-tokens", type=int,
+                            help=f"max tokens of the reports, 500 by default or {SECTIONED_MIN_TOKENS} with --sectioned")
+    arg_parser.add_argument("--seed", type=int, default=0, help="seed of the simulated failures")
+    arg_parser.add_argument("--json", help="write the results to this JSON file")
+    arg_parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    arg_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    payloads, responses = read_session_logs(args.log_dir)
+    if args.payloads:
+        payloads += [{field: account[field] for field in ACCOUNT_FIELDS} for account in read_accounts(args.payloads)]
+    if not payloads:
+        sys.exit(f"No form inputs found in {args.log_dir}" + (f" or {args.payloads}" if args.payloads else ""))
+    if not responses:
+        responses = [DEFAULT_RESPONSE.format(**payload) for payload in payloads]
+
+    results = run_benchmark(payloads, responses, args.documents, iterations=args.iterations,
+                            concurrency=args.concurrency, llm_latency=args.llm_latency,
+                            token_latency=args.token_latency, search_latency=args.search_latency,
+                            failure_rate=args.failure_rate, stream=args.stream, sectioned=args.sectioned,
+                            max_tokens=args.max_tokens or (SECTIONED_MIN_TOKENS if args.sectioned else 500),
+                            seed=args.seed)
+
+    print(f"{'scenario':<22}{'runs':>6}{'errors':>8}{'p50 s':>10}{'p95 s':>10}{'ops/s':>10}{'peak MB':>10}")
+    for result in results:
+        print(f"{result['scenario']:<22}{result['runs']:>6}{result['errors']:>8}{str(result['p50']):>10}"
+              f"{str(result['p95']):>10}{str(result['throughput']):>10}{result['peak_memory_mb']:>10}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# import necessary libraries
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import PyPDF2
+import docx
+
+PDF_MIME_TYPE = "application/pdf"
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+SUPPORTED_MIME_TYPES = (PDF_MIME_TYPE, DOCX_MIME_TYPE)
+
+CHARS_PER_TOKEN = 4  # rough average for English text
+
+# PDF text extraction, split by page range across worker processes for large documents
+PDF_PAGES_PER_TASK = 8  # pages extracted by one worker at a time, smaller documents are extracted in-process
+EXTRACT_MAX_WORKERS = min(4, os.cpu_count() or 1)  # worker processes shared by every document being parsed
+MAX_DOCUMENT_PAGES = 1000  # pages beyond this are not read, so a giant file cannot exhaust memory or time
+
+logger = logging.getLogger("sales_aipe.documents")
+
+
+# define the estimate_tokens function
+def estimate_tokens(text):
+    """_summary_: Estimate the number of tokens of a text without calling a tokenizer.
+        _params_: text (str): The text to measure.
+    _returns_: int: The estimated number of tokens.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+# define a function to start the extraction processes
+@functools.lru_cache(maxsize=1)
+def _get_process_pool(max_workers):
+    """_summary_: Start the text extraction processes once, they are shared by every document being parsed."""
+    # spawned workers do not inherit the locks of the threads of a Streamlit server, unlike forked ones
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+# define the extract_pdf_pages function
+def extract_pdf_pages(path, start, stop):
+    """_summary_: Extract the text of a range of pages of a PDF file, in a worker process.
+        _params_: path (str): The path of the PDF file.
+        start (int): The index of the first page.
+        stop (int): The index after the last page.
+    _returns_: list: The text of each page of the range.
+    """
+    pages = PyPDF2.PdfReader(path).pages
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+# define a function to extract the pages of a PDF file in parallel
+def _iter_pdf_pages_parallel(file, page_count, max_workers, pages_per_task):
+    """_summary_: Extract the pages of a PDF file by page range in the worker processes, yielding them in order.
+        The workers read the file from a temporary copy instead of receiving its bytes, and only a few ranges are
+        in flight at once, so the extracted text is never held for the whole document.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as copy:
+        file.seek(0)
+        shutil.copyfileobj(file, copy)
+    pool = _get_process_pool(max_workers)
+    in_flight = deque()
+    try:
+        for start in range(0, page_count, pages_per_task):
+            stop = min(start + pages_per_task, page_count)
+            in_flight.append(pool.submit(extract_pdf_pages, copy.name, start, stop))
+            if len(in_flight) >= max_workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+    except BrokenProcessPool:
+        # a worker died, e.g. killed for running out of memory, start new ones for the next document
+        _get_process_pool.cache_clear()
+        raise
+    finally:
+        for future in in_flight:
+            future.cancel()
+        os.remove(copy.name)
+
+
+# define the iter_pages function
+def iter_pages(file, mime_type, max_workers=EXTRACT_MAX_WORKERS, pages_per_task=PDF_PAGES_PER_TASK,
+               max_pages=MAX_DOCUMENT_PAGES):
+    """_summary_: Extract the text of a PDF or DOCX document one page at a time, without holding the whole text.
+        PDF documents longer than pages_per_task are extracted by page range in parallel worker processes, and the
+        pages are yielded in order as their ranges finish.
+        _params_: file (File): The uploaded file object.
+        mime_type (str): The MIME type of the file, PDF_MIME_TYPE or DOCX_MIME_TYPE.
+        max_workers (int): The number of worker processes, 1 to extract in the calling thread.
+        pages_per_task (int): The number of pages extracted by a worker at a time.
+        max_pages (int): The maximum number of PDF pages read, later pages are skipped.
+    _returns_: generator: The text of each PDF page, or of each DOCX paragraph.
+    """
+    # pdf files are parsed using PyPDF2, and docx files are parsed using the python-docx library
+    if mime_type == PDF_MIME_TYPE:
+        pages = PyPDF2.PdfReader(file).pages
+        page_count = len(pages)
+        if page_count > max_pages:
+            logger.warning(f"Reading the first {max_pages} of {page_count} pages of {getattr(file, 'name', 'PDF')}")
+            page_count = max_pages
+        if max_workers > 1 and page_count > pages_per_task:
+            yield from _iter_pdf_pages_parallel(file, page_count, max_workers, pages_per_task)
+        else:
+            for page in itertools.islice(pages, page_count):
+                yield page.extract_text() or ""
+    elif mime_type == DOCX_MIME_TYPE:
+        for paragraph in docx.Document(file).paragraphs:
+            yield paragraph.text
+    else:
+        raise ValueError(f"Unsupported file type: {mime_type}")
+
+
+# define the iter_chunks function
+def iter_chunks(texts, max_tokens):
+    """_summary_: Pack consecutive texts into chunks of at most max_tokens, splitting texts that are too long.
+        _params_: texts (iterable): The texts to pack, e.g. the pages of a document.
+        max_tokens (int): The maximum estimated number of tokens per chunk.
+    _returns_: generator: The chunks, in document order.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunk = []
+    size = 0
+    for text in texts:
+        text = " ".join(text.split())
+        if not text:
+            continue
+        # a single page longer than a chunk is cut into chunk-sized pieces
+        while len(text) > max_chars:
+            if chunk:
+                yield " ".join(chunk)
+                chunk, size = [], 0
+            yield text[:max_chars]
+            text = text[max_chars:]
+        if size + len(text) + 1 > max_chars and chunk:
+            yield " ".join(chunk)
+            chunk, size = [], 0
+        chunk.append(text)
+        size += len(text) + 1
+    if chunk:
+        yield " ".join(chunk)
+
+
+# define the map_ordered function
+def map_ordered(func, items, max_workers):
+    """_summary_: Apply a function to items on a thread pool, returning the results in input order.
+        Only a bounded number of items is in flight at once, so a long generator of items is never fully loaded.
+        _params_: func (callable): The function to apply to each item.
+        items (iterable): The items, e.g. a generator of document chunks.
+        max_workers (int): The number of items processed at the same time.
+    _returns_: list: The result of func for each item.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(executor.submit(func, item))
+            if len(in_flight) >= max_workers * 2:
+                results.append(in_flight.popleft().result())
+        while in_flight:
+            results.append(in_flight.popleft().result())
+    return results
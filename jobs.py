@@ -0,0 +1,132 @@
+# import necessary libraries
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from sqlite_store import SQLiteStore
+
+# job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+logger = logging.getLogger("sales_aipe.jobs")
+
+
+# define the JobQueue class
+class JobQueue(SQLiteStore):
+    """_summary_: SQLite-backed queue of jobs run by a fixed pool of worker threads.
+        Jobs outlive the Streamlit session that submitted them: a page can poll a job by its ID after a rerun or a
+        reload, and every session shares the same worker budget. Several processes can share the queue, each
+        claiming jobs atomically.
+    """
+    row_factory = sqlite3.Row
+
+    def __init__(self, handler, path="cache/jobs.sqlite3", workers=4, poll_interval=0.5, stale_after=15 * 60,
+                 retention=7 * 24 * 60 * 60):
+        """_summary_: Open (and create if needed) the queue database and start the workers.
+            _params_: handler (callable): The function that runs a job. It is called with the payload and a progress
+                function that stores partial output, and returns the JSON-serializable result.
+            path (str): The path of the SQLite database file.
+            workers (int): The number of jobs run at the same time by this process.
+            poll_interval (float): The seconds an idle worker waits before looking for jobs again.
+            stale_after (float): The seconds after which a running job is considered lost, e.g. because its
+                process was restarted, and is queued again.
+            retention (float): The seconds finished jobs are kept.
+        """
+        super().__init__(path)
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._wakeup = threading.Event()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, progress TEXT, result TEXT, "
+                "error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                         (DONE, FAILED, time.time() - retention))
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, payload):
+        """_summary_: Queue a job.
+            _params_: payload (dict): The JSON-serializable input of the handler.
+        _returns_: str: The ID of the job.
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+                         (job_id, QUEUED, json.dumps(payload), time.time()))
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """_summary_: Look up a job.
+            _params_: job_id (str): The ID of the job.
+        _returns_: dict: The status, partial progress, result and error of the job, its position in the queue
+            while it waits, or None if there is no such job.
+        """
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if job["status"] == QUEUED:
+            job["position"] = self._connect().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?", (QUEUED, job["created_at"])
+            ).fetchone()[0]
+        return job
+
+    def set_progress(self, job_id, progress):
+        """_summary_: Store the partial output of a running job, e.g. the report written so far.
+            _params_: job_id (str): The ID of the job.
+            progress (str): The partial output.
+        """
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+
+    def _claim(self):
+        """_summary_: Atomically take the oldest queued job, or a running job whose worker was lost.
+        _returns_: sqlite3.Row: The claimed job, or None if there is nothing to do.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE id = ("
+                "SELECT id FROM jobs WHERE status = ? OR (status = ? AND started_at < ?) ORDER BY created_at LIMIT 1"
+                ") RETURNING id, payload",
+                (RUNNING, now, QUEUED, RUNNING, now - self.stale_after),
+            ).fetchone()
+
+    def _work(self):
+        """_summary_: Run queued jobs until the process exits."""
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error claiming a job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job["id"], json.loads(job["payload"]))
+
+    def _run(self, job_id, payload):
+        """_summary_: Run one job and store its result or error."""
+        try:
+            result = self.handler(payload, lambda progress: self.set_progress(job_id, progress))
+            status, result, error = DONE, json.dumps(result), None
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            status, result, error = FAILED, None, str(e)
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (status, result, error, time.time(), job_id))
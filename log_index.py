@@ -0,0 +1,435 @@
+# import necessary libraries
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from metrics import percentile
+from result_cache import normalize_url
+
+# header of a session log record, with the session ID written since the shared log writer was introduced
+LOG_RECORD = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - ([A-Z]+) - (?:(\d{8}_\d{6}_[0-9a-f]{6}|-) - )?(.*)$")
+# name of the per-session log files written before the shared log, which carry the session ID
+SESSION_FILE = re.compile(r"session_(\d{8}_\d{6})\.log$")
+
+# labels of the logged form fields
+FORM_LABELS = {
+    "Product Name": "product_name",
+    "Company URL": "company_url",
+    "Product Category": "product_category",
+    "Competitors": "competitors",
+    "Value Proposition": "value_proposition",
+    "Target Customer": "target_customer",
+}
+
+# log messages indexed as events, with the kind they are stored as; the first group is the subject, the second
+# the detail. Other errors and warnings are stored as they are, other messages are skipped.
+EVENT_MESSAGES = [
+    ("start", re.compile(r"Application started")),
+    ("end", re.compile(r"Application session ended")),
+    ("reset", re.compile(r"Application reset")),
+    ("form", re.compile(r"User submitted form")),
+    ("scrape", re.compile(r"Successfully scraped website: (.+)")),
+    ("scrape_cached", re.compile(r"Served website from cache: (.+)")),
+    ("scrape_empty", re.compile(r"No data found for URL: (.+)")),
+    ("scrape_error", re.compile(r"Error scraping website (\S+): (.*)", re.S)),
+    ("parse", re.compile(r"Successfully parsed (?:PDF|DOCX) file: (.+?)(?: \((.*)\))?$")),
+    ("parse", re.compile(r"Document already indexed, skipped parsing (?:PDF|DOCX) file: (.+)()")),
+    ("parse", re.compile(r"Uploaded file parsed: (.+)")),
+    ("parse_error", re.compile(r"Error parsing file (.+?): (.*)", re.S)),
+    ("prompt", re.compile(r"Insights prompt: ()(\d+) tokens")),
+    ("generate_cached", re.compile(r"Insights served from cache: (\w+)")),
+    ("generate", re.compile(r"Insights generated")),
+    ("generate_error", re.compile(r"Error generating insights: ()(.*)", re.S)),
+    ("job", re.compile(r"Report job submitted: (\w+)")),
+    ("pdf", re.compile(r"Successfully generated PDF(?:: (.+))?|PDF generated|PDF download button displayed")),
+    ("pdf_error", re.compile(r"Error generating PDF: ()(.*)", re.S)),
+    ("report", re.compile(r"Successfully generated (DOCX|HTML): (.+)")),
+    ("report_error", re.compile(r"Error generating (DOCX|HTML): (.*)", re.S)),
+]
+MAX_DETAIL_CHARS = 500  # longer error messages are cut, so the index stays compact
+SETTLE_SECONDS = 60  # a file untouched for this long is not written anymore, so its last record is complete
+
+logger = logging.getLogger("sales_aipe.log_index")
+
+
+# define the format_time function
+def format_time(timestamp):
+    """_summary_: Format a Unix timestamp the way log times are stored in the index, e.g. "2024-12-11 16:21:32.524"."""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")[:23]
+
+
+# define the iter_log_records function
+def iter_log_records(f, offset=0, settled=True):
+    """_summary_: Read the records of a session log from a byte offset, joining multi-line messages.
+        _params_: f (file): The log file, opened in binary mode.
+        offset (int): The byte offset of the first record to read.
+        settled (bool): Whether the file is finished. Otherwise its last record is held back, because more lines
+            of its message may still be written, and so is a last line without a newline.
+    _returns_: generator: The records as (asctime, level, session_id, message, next_offset) tuples, where
+        next_offset is where reading resumes after the record. session_id is None in the per-session log files.
+    """
+    f.seek(offset)
+    record = None
+    position = offset
+    for raw in f:
+        if not raw.endswith(b"\n") and not settled:
+            break
+        # older logs were written in the platform encoding, so undecodable bytes are replaced
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        match = LOG_RECORD.match(line)
+        if match:
+            if record:
+                yield (*record, position)
+            record = list(match.groups())
+        elif record:
+            # continuation line of a multi-line message
+            record[3] += "\n" + line
+        position += len(raw)
+    if record and settled:
+        yield (*record, position)
+
+
+# define the classify function
+def classify(level, message):
+    """_summary_: Find the kind of event a log message records.
+        _params_: level (str): The level of the record, e.g. "INFO".
+        message (str): The message of the record.
+    _returns_: tuple: The kind, subject and detail of the event, or None if the message is not indexed.
+    """
+    for kind, pattern in EVENT_MESSAGES:
+        match = pattern.match(message)
+        if match:
+            groups = match.groups() + (None, None)
+            return kind, groups[0] or None, (groups[1] or None) and groups[1][:MAX_DETAIL_CHARS]
+    if message.startswith("Generated Insights:"):
+        # only the size of the insights is kept, their text is in the insight cache
+        return "insights", None, str(len(message.split("\n", 1)[-1].strip()))
+    if level in ("ERROR", "WARNING", "CRITICAL"):
+        return level.lower(), None, message[:MAX_DETAIL_CHARS]
+    return None
+
+
+# define the read_session_logs function
+def read_session_logs(log_dir):
+    """_summary_: Extract the submitted forms and generated insights recorded in the session logs.
+        Both the per-session log files and the shared sessions.log (with session IDs) are read. The form fields
+        are collected per session, so sessions writing to the shared log at the same time are kept apart.
+        _params_: log_dir (str): The directory of the session logs.
+    _returns_: tuple: The form inputs (list of dict) and the generated insights (list of str).
+    """
+    payloads, responses = [], []
+    # the form being filled in by each session, keyed by session ID, or by the file of a per-session log
+    forms = {}
+    paths = sorted(glob.glob(os.path.join(log_dir, "session_*.log")) + glob.glob(os.path.join(log_dir, "sessions.log*")))
+    for path in paths:
+        with open(path, "rb") as f:
+            records = [(session_id, message) for _, _, session_id, message, _ in iter_log_records(f)]
+        for session_id, message in records:
+            key = session_id if session_id and session_id != "-" else path
+            if message.startswith("User submitted form"):
+                forms[key] = {}
+            elif message.startswith("Generated Insights:"):
+                responses.append(message.split("\n", 1)[-1].strip())
+            elif key in forms:
+                label, _, value = message.partition(": ")
+                if label in FORM_LABELS:
+                    form = forms[key]
+                    form[FORM_LABELS[label]] = value.strip()
+                    if len(form) == len(FORM_LABELS):
+                        payloads.append(forms.pop(key))
+    return payloads, [response for response in responses if response]
+
+
+# define the LogIndex class
+class LogIndex:
+    """_summary_: SQLite index of the session logs and stage timing events, updated incrementally.
+        Each log file is read from the byte offset where the previous update stopped, so only new lines are parsed.
+        Files are identified by a hash of their first line rather than their path, so a rotated sessions.log is
+        recognized under its new name and not read again.
+    """
+
+    def __init__(self, path="cache/log_index.sqlite3", log_dir="session_logs"):
+        """_summary_: Open (and create if needed) the index database.
+            _params_: path (str): The path of the SQLite database file.
+            log_dir (str): The directory of the session logs.
+        """
+        self.path = path
+        self.log_dir = log_dir
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    head TEXT PRIMARY KEY, path TEXT NOT NULL, offset INTEGER NOT NULL, indexed_at REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY, first_ts TEXT, last_ts TEXT, events INTEGER NOT NULL DEFAULT 0,
+                    forms INTEGER NOT NULL DEFAULT 0, errors INTEGER NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY, session_id TEXT, ts TEXT NOT NULL, level TEXT NOT NULL,
+                    kind TEXT NOT NULL, subject TEXT, detail TEXT);
+                CREATE INDEX IF NOT EXISTS events_kind ON events (kind, ts);
+                CREATE TABLE IF NOT EXISTS forms (
+                    id INTEGER PRIMARY KEY, session_id TEXT, ts TEXT NOT NULL, product_name TEXT, company_url TEXT,
+                    product_category TEXT, competitors TEXT, value_proposition TEXT, target_customer TEXT);
+                CREATE INDEX IF NOT EXISTS forms_session ON forms (session_id, id);
+                CREATE TABLE IF NOT EXISTS requested_urls (
+                    form_id INTEGER NOT NULL, session_id TEXT, ts TEXT NOT NULL, url TEXT NOT NULL,
+                    role TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS requested_urls_ts ON requested_urls (ts);
+                CREATE TABLE IF NOT EXISTS spans (
+                    ts TEXT NOT NULL, stage TEXT NOT NULL, status TEXT, duration REAL, subject TEXT,
+                    input_tokens INTEGER, output_tokens INTEGER, time_to_first_token REAL);
+                CREATE INDEX IF NOT EXISTS spans_stage ON spans (stage, ts);
+            """)
+
+    def update(self):
+        """_summary_: Index the lines written to the session logs and events file since the last update.
+        _returns_: dict: The number of files read, bytes parsed and records indexed.
+        """
+        stats = {"files": 0, "bytes": 0, "records": 0}
+        paths = (glob.glob(os.path.join(self.log_dir, "session_*.log")) +
+                 glob.glob(os.path.join(self.log_dir, "sessions.log*")) +
+                 glob.glob(os.path.join(self.log_dir, "events.jsonl*")))
+        # oldest first, so the rotated files are read before the file that replaced them
+        for path in sorted(paths, key=os.path.getmtime):
+            read, records = self.update_file(path)
+            if read:
+                stats["files"] += 1
+                stats["bytes"] += read
+                stats["records"] += records
+        return stats
+
+    def update_file(self, path):
+        """_summary_: Index the new lines of one log file.
+            _params_: path (str): The path of the session log or events file.
+        _returns_: tuple: The number of bytes parsed and of records indexed.
+        """
+        session_file = SESSION_FILE.search(os.path.basename(path))
+        with open(path, "rb") as f:
+            first_line = f.readline(1024)
+            if not first_line.endswith(b"\n"):
+                # an empty per-session log is still a session, one that never got to log anything
+                if session_file and not first_line:
+                    started = datetime.strptime(session_file.group(1), "%Y%m%d_%H%M%S")
+                    with self.conn:
+                        self.conn.execute("INSERT OR IGNORE INTO sessions (session_id, first_ts, last_ts) "
+                                          "VALUES (?, ?, ?)", (session_file.group(1), format_time(started.timestamp()),
+                                                               format_time(started.timestamp())))
+                return 0, 0
+            head = hashlib.sha1(first_line).hexdigest()
+            row = self.conn.execute("SELECT offset FROM files WHERE head = ?", (head,)).fetchone()
+            offset = row[0] if row else 0
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return 0, 0
+            settled = time.time() - os.path.getmtime(path) > SETTLE_SECONDS
+            with self.conn:
+                if os.path.basename(path).startswith("events.jsonl"):
+                    end, records = self._index_spans(f, offset, settled)
+                else:
+                    end, records = self._index_records(f, offset, settled,
+                                                       session_file.group(1) if session_file else None)
+                self.conn.execute("INSERT OR REPLACE INTO files (head, path, offset, indexed_at) VALUES (?, ?, ?, ?)",
+                                  (head, path, end, time.time()))
+        return end - offset, records
+
+    def _index_records(self, f, offset, settled, file_session_id):
+        sessions = {}
+        records = 0
+        end = offset
+        for asctime, level, session_id, message, end in iter_log_records(f, offset, settled):
+            records += 1
+            session_id = file_session_id or (session_id if session_id != "-" else None)
+            ts = asctime.replace(",", ".")
+            if session_id:
+                session = sessions.setdefault(session_id, {"first_ts": ts, "last_ts": ts, "events": 0, "forms": 0,
+                                                           "errors": 0})
+                session["last_ts"] = ts
+            label, _, value = message.partition(": ")
+            if label in FORM_LABELS:
+                self._add_form_field(session_id, ts, FORM_LABELS[label], value.strip())
+                continue
+            event = classify(level, message)
+            if event is None:
+                continue
+            kind, subject, detail = event
+            self.conn.execute("INSERT INTO events (session_id, ts, level, kind, subject, detail) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (session_id, ts, level, kind, subject, detail))
+            if kind == "form":
+                self.conn.execute("INSERT INTO forms (session_id, ts) VALUES (?, ?)", (session_id, ts))
+            if session_id:
+                session["events"] += 1
+                session["forms"] += kind == "form"
+                session["errors"] += level == "ERROR"
+        for session_id, session in sessions.items():
+            self.conn.execute(
+                "INSERT INTO sessions (session_id, first_ts, last_ts, events, forms, errors) "
+                "VALUES (:session_id, :first_ts, :last_ts, :events, :forms, :errors) "
+                "ON CONFLICT (session_id) DO UPDATE SET first_ts = MIN(first_ts, excluded.first_ts), "
+                "last_ts = MAX(last_ts, excluded.last_ts), events = events + excluded.events, "
+                "forms = forms + excluded.forms, errors = errors + excluded.errors",
+                dict(session, session_id=session_id),
+            )
+        return end, records
+
+    def _add_form_field(self, session_id, ts, column, value):
+        # the fields follow the "User submitted form" record of their session, possibly in an earlier update
+        form = self.conn.execute("SELECT id FROM forms WHERE session_id IS ? ORDER BY id DESC LIMIT 1",
+                                 (session_id,)).fetchone()
+        if form is None:
+            return
+        self.conn.execute(f"UPDATE forms SET {column} = ? WHERE id = ?", (value, form[0]))
+        if column in ("company_url", "competitors"):
+            role = "company" if column == "company_url" else "competitor"
+            urls = [url for url in value.split(",") if url.strip()]
+            self.conn.executemany("INSERT INTO requested_urls (form_id, session_id, ts, url, role) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  [(form[0], session_id, ts, normalize_url(url), role) for url in urls])
+
+    def _index_spans(self, f, offset, settled):
+        f.seek(offset)
+        end = offset
+        rows = []
+        for raw in f:
+            if not raw.endswith(b"\n") and not settled:
+                break
+            end += len(raw)
+            try:
+                span = json.loads(raw)
+            except ValueError:
+                continue
+            rows.append((format_time(span.get("timestamp") or 0), span.get("stage"), span.get("status"),
+                         span.get("duration"), span.get("url") or span.get("file") or span.get("section"),
+                         span.get("input_tokens"), span.get("output_tokens"), span.get("time_to_first_token")))
+        self.conn.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return end, len(rows)
+
+    def query(self, sql, params=()):
+        """_summary_: Run a query against the index.
+            _params_: sql (str): The SQL query.
+            params (tuple): The parameters of the query.
+        _returns_: tuple: The column names and the rows of the result.
+        """
+        cursor = self.conn.execute(sql, params)
+        return [column[0] for column in cursor.description or []], cursor.fetchall()
+
+    def stage_latencies(self, since):
+        """_summary_: Summarize the timings of each pipeline stage.
+            _params_: since (str): The earliest time included, in the stored time format.
+        _returns_: tuple: The column names and one row per stage with its count, errors and latency percentiles.
+        """
+        durations, errors = {}, {}
+        for stage, status, duration in self.conn.execute(
+                "SELECT stage, status, duration FROM spans WHERE ts >= ? AND duration IS NOT NULL", (since,)):
+            durations.setdefault(stage, []).append(duration)
+            errors[stage] = errors.get(stage, 0) + (status != "ok")
+        rows = [(stage, len(values), errors[stage], percentile(values, 0.5), percentile(values, 0.95), max(values))
+                for stage, values in sorted(durations.items())]
+        return ["stage", "count", "errors", "p50 s", "p95 s", "max s"], rows
+
+    def top_domains(self, since, top):
+        """_summary_: Find the websites requested most often.
+            _params_: since (str): The earliest time included, in the stored time format.
+            top (int): The number of websites returned.
+        _returns_: tuple: The column names and one row per website, most requested first.
+        """
+        return self.query(
+            "SELECT url, COUNT(*) AS requests, SUM(role = 'company') AS as_company, "
+            "COUNT(DISTINCT session_id) AS sessions, MAX(ts) AS last_requested FROM requested_urls "
+            "WHERE ts >= ? GROUP BY url ORDER BY requests DESC, url LIMIT ?", (since, top))
+
+    def daily_sessions(self, since):
+        """_summary_: Count the sessions of each day, with those that submitted nothing and those with errors.
+            _params_: since (str): The earliest time included, in the stored time format.
+        _returns_: tuple: The column names and one row per day.
+        """
+        return self.query(
+            "SELECT substr(first_ts, 1, 10) AS day, COUNT(*) AS sessions, SUM(forms > 0) AS submitted, "
+            "SUM(forms) AS forms, SUM(events = 0) AS empty, SUM(errors > 0) AS with_errors FROM sessions "
+            "WHERE first_ts >= ? GROUP BY day ORDER BY day", (since,))
+
+    def top_errors(self, since, top):
+        """_summary_: Find the most frequent errors.
+            _params_: since (str): The earliest time included, in the stored time format.
+            top (int): The number of errors returned.
+        _returns_: tuple: The column names and one row per distinct error, most frequent first.
+        """
+        return self.query(
+            "SELECT kind, COALESCE(detail, subject) AS error, COUNT(*) AS count, MAX(ts) AS last_seen FROM events "
+            "WHERE ts >= ? AND (level = 'ERROR' OR kind LIKE '%error') GROUP BY kind, error "
+            "ORDER BY count DESC LIMIT ?", (since, top))
+
+
+# define the parse_since function
+def parse_since(value):
+    """_summary_: Turn a --since argument into the stored time format.
+        _params_: value (str): A duration back from now, e.g. "7d" or "12h", or a date such as "2024-12-11".
+    _returns_: str: The earliest time to include.
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([dhm])", value)
+    if match:
+        unit = {"d": "days", "h": "hours", "m": "minutes"}[match.group(2)]
+        return format_time((datetime.now() - timedelta(**{unit: float(match.group(1))})).timestamp())
+    return value
+
+
+# define the print_table function
+def print_table(columns, rows):
+    """_summary_: Print query results as an aligned text table."""
+    cells = [[f"{value:.4f}" if isinstance(value, float) else str(value) for value in row] for row in rows]
+    widths = [max([len(column)] + [len(row[i]) for row in cells]) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in cells:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+# define the main function for the command line
+def main():
+    arg_parser = argparse.ArgumentParser(description="Index the session logs into SQLite and query latency and usage.")
+    arg_parser.add_argument("--log-dir", default="session_logs", help="directory of the session logs")
+    arg_parser.add_argument("--db", default="cache/log_index.sqlite3", help="path of the index database")
+    arg_parser.add_argument("--no-update", action="store_true", help="query the index without reading new log lines")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("update", help="index the new log lines")
+    for name, help_text in (("stages", "latency percentiles of each pipeline stage"),
+                            ("domains", "most requested websites"),
+                            ("sessions", "sessions per day"),
+                            ("errors", "most frequent errors")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--since", default="7d", help="e.g. 7d, 12h or 2024-12-11 (default: 7d)")
+        if name in ("domains", "errors"):
+            command.add_argument("--top", type=int, default=20, help="number of rows shown")
+    sql_command = commands.add_parser("sql", help="run a SQL query against the index")
+    sql_command.add_argument("query", help="the query, e.g. \"SELECT kind, COUNT(*) FROM events GROUP BY kind\"")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    index = LogIndex(args.db, args.log_dir)
+    if not args.no_update:
+        stats = index.update()
+        logger.info(f"Indexed {stats['records']} records ({stats['bytes']} bytes) from {stats['files']} files")
+    if args.command == "stages":
+        print_table(*index.stage_latencies(parse_since(args.since)))
+    elif args.command == "domains":
+        print_table(*index.top_domains(parse_since(args.since), args.top))
+    elif args.command == "sessions":
+        print_table(*index.daily_sessions(parse_since(args.since)))
+    elif args.command == "errors":
+        print_table(*index.top_errors(parse_since(args.since), args.top))
+    elif args.command == "sql":
+        index.conn.execute("PRAGMA query_only = ON")
+        print_table(*index.query(args.query))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# import necessary libraries
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger("sales_aipe.metrics")
+
+
+# define the percentile function
+def percentile(values, q):
+    """_summary_: Return the nearest-rank percentile of a list of values.
+        _params_: values (list): The measured values.
+        q (float): The percentile, between 0 and 1.
+    _returns_: float: The percentile, or None if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+# define the Metrics class
+class Metrics:
+    """_summary_: Process-wide timing and token counters of the insight pipeline stages.
+        Each stage is timed with a span, which is aggregated into per-stage histograms, appended to the caller's
+        trace (if any) and emitted as a JSON event.
+    """
+
+    def __init__(self, event_logger=None):
+        """_summary_: Create an empty set of counters.
+            _params_: event_logger (logging.Logger): Optional logger that receives one JSON line per span.
+        """
+        self.event_logger = event_logger
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._tokens = {"input": 0, "output": 0}
+
+    @contextmanager
+    def span(self, stage, trace=None, **attributes):
+        """_summary_: Time a pipeline stage.
+            The yielded dictionary can be updated with attributes, e.g. token counts, and with a "status" of
+            "error" when the stage handles its own failure. An exception leaving the block also marks an error.
+            _params_: stage (str): The name of the stage, e.g. "scrape_website".
+            trace (list): Optional list the finished span is appended to, e.g. the spans of one request.
+            attributes: Extra attributes of the span, e.g. the URL being scraped.
+        _returns_: dict: The span, yielded to the block.
+        """
+        span = {"stage": stage, **attributes}
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span["status"] = "error"
+            span.setdefault("error", str(e))
+            raise
+        finally:
+            span.setdefault("status", "ok")
+            span["duration"] = round(time.perf_counter() - start, 4)
+            span["timestamp"] = time.time()
+            self.record(span)
+            if trace is not None:
+                trace.append(span)
+
+    def record(self, span):
+        """_summary_: Add a finished span to the counters and emit it as a JSON event.
+            _params_: span (dict): The span, with at least "stage", "status" and "duration".
+        """
+        with self._lock:
+            stats = self._stages.setdefault(span["stage"], {
+                "count": 0, "errors": 0, "sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS),
+                "ttft_count": 0, "ttft_sum": 0.0,
+            })
+            stats["count"] += 1
+            stats["sum"] += span["duration"]
+            if span["status"] != "ok":
+                stats["errors"] += 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if span["duration"] <= bound:
+                    stats["buckets"][i] += 1
+            if span.get("time_to_first_token") is not None:
+                stats["ttft_count"] += 1
+                stats["ttft_sum"] += span["time_to_first_token"]
+            self._tokens["input"] += span.get("input_tokens") or 0
+            self._tokens["output"] += span.get("output_tokens") or 0
+        if self.event_logger:
+            self.event_logger.info(json.dumps(span, default=str))
+
+    def prometheus_text(self):
+        """_summary_: Render the counters in the Prometheus text exposition format.
+        _returns_: str: The metrics page.
+        """
+        with self._lock:
+            stages = {stage: dict(stats, buckets=list(stats["buckets"])) for stage, stats in self._stages.items()}
+            tokens = dict(self._tokens)
+        lines = [
+            "# HELP sales_aipe_stage_duration_seconds Duration of the insight pipeline stages.",
+            "# TYPE sales_aipe_stage_duration_seconds histogram",
+        ]
+        for stage, stats in sorted(stages.items()):
+            # record() already counts every span in all the buckets it fits, as Prometheus expects
+            for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+                lines.append(f'sales_aipe_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'sales_aipe_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'sales_aipe_stage_duration_seconds_sum{{stage="{stage}"}} {stats["sum"]:.4f}')
+            lines.append(f'sales_aipe_stage_duration_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines += [
+            "# HELP sales_aipe_stage_errors_total Failed insight pipeline stages.",
+            "# TYPE sales_aipe_stage_errors_total counter",
+        ]
+        for stage, stats in sorted(stages.items()):
+            lines.append(f'sales_aipe_stage_errors_total{{stage="{stage}"}} {stats["errors"]}')
+        lines += [
+            "# HELP sales_aipe_llm_time_to_first_token_seconds Time until the LLM returned its first token.",
+            "# TYPE sales_aipe_llm_time_to_first_token_seconds summary",
+        ]
+        for stage, stats in sorted(stages.items()):
+            if stats["ttft_count"]:
+                lines.append(f'sales_aipe_llm_time_to_first_token_seconds_sum{{stage="{stage}"}} '
+                             f'{stats["ttft_sum"]:.4f}')
+                lines.append(f'sales_aipe_llm_time_to_first_token_seconds_count{{stage="{stage}"}} '
+                             f'{stats["ttft_count"]}')
+        lines += [
+            "# HELP sales_aipe_llm_tokens_total Tokens sent to and generated by the LLM.",
+            "# TYPE sales_aipe_llm_tokens_total counter",
+            f'sales_aipe_llm_tokens_total{{direction="input"}} {tokens["input"]}',
+            f'sales_aipe_llm_tokens_total{{direction="output"}} {tokens["output"]}',
+        ]
+        return "\n".join(lines) + "\n"
+
+
+# define the timed_stream function
+def timed_stream(chunks, span, start=None):
+    """_summary_: Pass a token stream through, recording the time to the first token in the span.
+        _params_: chunks (iterator): The token stream, e.g. from chain.stream.
+        span (dict): The span of the LLM call.
+        start (float): The time.perf_counter() value the request was sent at, by default when the stream is read.
+    _returns_: generator: The same tokens.
+    """
+    if start is None:
+        start = time.perf_counter()
+    for chunk in chunks:
+        if "time_to_first_token" not in span:
+            span["time_to_first_token"] = round(time.perf_counter() - start, 4)
+        yield chunk
+
+
+# define the start_metrics_server function
+def start_metrics_server(metrics, port, host="127.0.0.1"):
+    """_summary_: Serve the Prometheus metrics page at /metrics from a background thread.
+        _params_: metrics (Metrics): The counters to serve.
+        port (int): The port to listen on.
+        host (str): The interface to listen on, only the local machine by default.
+    _returns_: ThreadingHTTPServer: The server, or None if the port is already taken (e.g. by another process).
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes are too frequent to log
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Metrics server not started on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
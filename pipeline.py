@@ -0,0 +1,935 @@
+# import necessary libraries
+import hashlib
+import itertools
+import logging
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+import httpx
+import requests
+from pydantic import PrivateAttr
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_groq import ChatGroq
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_community.utilities.tavily_search import TAVILY_API_URL, TavilySearchAPIWrapper
+from metrics import Metrics, timed_stream
+from documents import (CHARS_PER_TOKEN, PDF_MIME_TYPE, SUPPORTED_MIME_TYPES, estimate_tokens, iter_chunks,
+                       iter_pages, map_ordered)
+from prompt_budget import fit_prompt, serialize_competitors
+from reports import ReportRenderer
+from resilience import Backend, CircuitOpenError, is_retryable
+from result_cache import InsightCache
+from retrieval import DOCUMENT, INSIGHT
+
+GROQ_MODEL = "llama-3.3-70b-versatile"  # Groq model used when none is configured
+GROQ_DRAFT_MODEL = "llama-3.1-8b-instant"  # small, fast Groq model that writes the first draft
+
+# Connection pool settings shared by the Groq and Tavily clients
+HTTP_POOL_SIZE = 20  # keep-alive connections kept open per backend
+HTTP_TIMEOUT = 60  # seconds before an API request is abandoned
+
+# Request rates allowed by the providers, shared by every session of the process
+GROQ_RPM = 30  # Groq requests per minute, per model
+TAVILY_RPM = 100  # Tavily searches per minute
+
+# Concurrency settings for the website lookups
+SCRAPE_MAX_WORKERS = 6  # maximum number of lookups running at the same time
+SCRAPE_TIMEOUT = 20  # seconds to wait for each URL before giving up on it
+
+# Settings for condensing uploaded documents
+DOCUMENT_CHUNK_TOKENS = 2000  # size of the document chunks condensed by one LLM call
+DOCUMENT_DIGEST_TOKENS = 1500  # maximum size of the document digest passed to the insights prompt
+DOCUMENT_MAX_WORKERS = 4  # maximum number of chunks condensed at the same time
+DOCUMENT_MAX_ROUNDS = 3  # maximum number of times the digests are condensed again to fit the budget
+CHUNK_DIGEST_WORDS = 150  # target length of the digest of one chunk
+
+# Settings for retrieving passages from the passage index
+RETRIEVAL_CHUNK_TOKENS = 250  # size of the passages stored in the index
+RETRIEVAL_TOP_K = 6  # passages of the uploaded document passed to the insights prompt
+RETRIEVAL_INSIGHT_TOP_K = 3  # passages of earlier insights passed to the insights prompt
+
+# Token budget of the insights prompt
+PROMPT_MAX_TOKENS = 4000  # maximum size of the insights prompt, template included
+# maximum size of each field, in the order they are trimmed to fit; together they leave room under
+# PROMPT_MAX_TOKENS for the ~500 tokens of the template
+PROMPT_FIELD_BUDGETS = {
+    "competitors_data": 400,
+    "past_insights": 500,
+    "product_document": DOCUMENT_DIGEST_TOKENS,
+    "company_description": 500,
+    "target_customer": 150,
+    "value_proposition": 250,
+    "company_title": 40,
+    "product_name": 40,
+    "product_category": 40,
+}
+
+# Settings of the fast first draft, written while the full report is generated
+DRAFT_MAX_TOKENS = 300  # maximum length of the draft
+DRAFT_PROMPT_MAX_TOKENS = 1500  # maximum size of the draft prompt, template included
+DRAFT_FIELD_BUDGETS = {  # maximum size of each field of the draft prompt, in the order they are trimmed
+    "competitors": 100,
+    "product_document": 800,
+    "target_customer": 100,
+    "value_proposition": 200,
+    "company_url": 40,
+    "product_name": 40,
+    "product_category": 40,
+}
+
+# Settings of the sectioned report, where every section is written by its own LLM call
+SECTION_MIN_TOKENS = 150  # minimum length of a section, the max tokens setting is shared between the sections
+SECTION_RETRIES = 2  # times a failed section is retried on its own
+
+INSIGHTS_PROMPT_VERSION = 4  # bump when the insights prompt changes so older cached insights are not served
+
+# define the prompt template for condensing a chunk of an uploaded document
+CONDENSE_PROMPT = """
+    You are preparing notes for a sales representative. Condense the following excerpt of a product document
+    into the facts that matter for selling it: key features, benefits, specifications, pricing, differentiators
+    and target customers. Use at most {max_words} words and do not add information that is not in the excerpt.
+
+    Excerpt:
+    {text}
+    """
+
+# define the details shared by the insights prompt and the section prompts
+INSIGHTS_CONTEXT = """
+    You are a seasoned sales assistant. Based on the following details:
+    - **Company:** {company_title} ({company_description})
+    - Product Name: {product_name}
+    - Product Category: {product_category}
+    - Competitors Data: {competitors_data}
+    - Value Proposition: {value_proposition}
+    - Target Customer: {target_customer}
+    - Product Document Notes: {product_document}
+    - Notes From Earlier Insights: {past_insights}
+
+"""
+
+# define the sections of the report, in the order they are assembled
+REPORT_SECTIONS = [
+    ("Product and Company Overview", """
+    * Generate a concise summary of the product and company, including key features, benefits, and unique selling points.
+    * Provide a recent news article or press release about the product or company to add current context.
+"""),
+    ("Competitive Landscape", """
+    * compare the target product/product with the given competitors in terms of their offerings, highlighting strengths and weaknesses.
+    * Analyze the product's value proposition and differentiation factors using a SWOT (Strengths, Weaknesses, Opportunities, Threats) framework.
+"""),
+    ("Target Customer Analysis", """
+    * Define the ideal customer persona, including demographics, psychographics, and behavioral characteristics.
+    * Identify key pain points of the target customer and explain how the product addresses each one.
+    * Develop a unique selling proposition (USP) that clearly communicates the product's value to the target customer.
+"""),
+    ("Sales Strategy and Approach", """
+    * Recommend an ideal sales approach (e.g., consultative selling, solution selling) and explain why it's suitable for this product and target customer.
+    * Anticipate potential objections and provide concise, effective counterarguments for each.
+    * Identify the most effective sales channels for reaching the target customer and explain the rationale for each.
+"""),
+    ("Sample Sales Pitch", """
+    * Generate a sample sales pitch paragraph incorporating the insights from the above analysis, ensure the sales pitch is:
+        - Attention-grabbing
+        - Solution presentation
+        - Product highlights and benefits
+        - Call to action
+"""),
+]
+# max tokens below which a sectioned report is written in one call, too few to give every section its minimum
+SECTIONED_MIN_TOKENS = len(REPORT_SECTIONS) * SECTION_MIN_TOKENS
+
+# define the prompt template for generating insights
+INSIGHTS_PROMPT = INSIGHTS_CONTEXT + "".join(f"    {title}{instructions}" for title, instructions in REPORT_SECTIONS)
+
+# define the prompt templates for generating one section of the report at a time
+SECTION_PROMPTS = {
+    title: INSIGHTS_CONTEXT + f"    Write only the following section of a sales insights report, starting with its "
+                              f"title as a heading:\n    {title}{instructions}"
+    for title, instructions in REPORT_SECTIONS
+}
+
+
+# define the prompt template for the fast first draft
+DRAFT_PROMPT = """
+    You are a seasoned sales assistant. Write a short first draft of sales insights based on the following details:
+    - Company URL: {company_url}
+    - Product Name: {product_name}
+    - Product Category: {product_category}
+    - Competitors: {competitors}
+    - Value Proposition: {value_proposition}
+    - Target Customer: {target_customer}
+    - Product Document Notes: {product_document}
+
+    Product and Company Overview
+    * Summarize the product and company in two or three sentences, including what sets them apart.
+    Sample Sales Pitch
+    * Write one short sales pitch paragraph for the target customer, ending with a call to action.
+    """
+
+
+# define the PooledTavilySearchAPIWrapper class
+class PooledTavilySearchAPIWrapper(TavilySearchAPIWrapper):
+    """_summary_: Tavily API wrapper that sends every search through one keep-alive requests.Session,
+        instead of opening a new connection (and TLS handshake) per search like the stock wrapper.
+    """
+    _session: requests.Session = PrivateAttr(default=None)
+    _backend: Backend = PrivateAttr(default=None)
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, backend=None, **kwargs):
+        super().__init__(**kwargs)
+        self._backend = backend
+        self._session = requests.Session()
+        # one pool for the Tavily host, large enough for every concurrent lookup to keep its connection
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+
+    def raw_results(self, query, max_results=5, search_depth="advanced", include_domains=[], exclude_domains=[],
+                    include_answer=False, include_raw_content=False, include_images=False):
+        params = {
+            "api_key": self.tavily_api_key.get_secret_value(),
+            "query": query,
+            "max_results": max_results,
+            "search_depth": search_depth,
+            "include_domains": include_domains,
+            "exclude_domains": exclude_domains,
+            "include_answer": include_answer,
+            "include_raw_content": include_raw_content,
+            "include_images": include_images,
+        }
+        if self._backend is None:
+            return self._post(params)
+        # identical searches in flight at the same time share one request
+        key = repr(sorted((name, value) for name, value in params.items() if name != "api_key"))
+        return self._backend.call(self._post, params, key=key)
+
+    def _post(self, params):
+        response = self._session.post(f"{TAVILY_API_URL}/search", json=params, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+
+# define the Clients class
+@dataclass
+class Clients:
+    """_summary_: Bundle of the LLM, search and output parser clients used by the pipeline.
+        The clients are thread safe and keep their connections open, so one bundle should be shared per process.
+    """
+    llm: object
+    search: object
+    parser: object = field(default_factory=StrOutputParser)
+    draft_llm: object = None
+    # rate limit, retry and circuit breaker policies of the backends, if any
+    llm_backend: Backend = None
+    draft_backend: Backend = None
+    search_backend: Backend = None
+
+    def backend_for(self, llm):
+        """_summary_: Return the policy of the backend of an LLM of this bundle, or None if it has none."""
+        return self.draft_backend if llm is self.draft_llm else self.llm_backend
+
+    @classmethod
+    def from_keys(cls, groq_api_key, tavily_api_key, model_name=GROQ_MODEL, pool_size=HTTP_POOL_SIZE,
+                  draft_model_name=GROQ_DRAFT_MODEL, groq_rpm=GROQ_RPM, tavily_rpm=TAVILY_RPM):
+        """_summary_: Build the Groq and Tavily clients from API keys, each with a pool of keep-alive connections.
+            _params_: groq_api_key (str): The Groq API key.
+            tavily_api_key (str): The Tavily API key.
+            model_name (str): The Groq model to use.
+            pool_size (int): The number of keep-alive connections kept open per backend.
+            draft_model_name (str): The Groq model that writes the fast first draft, sharing the connection pool.
+            groq_rpm (float): The Groq requests per minute allowed for each model.
+            tavily_rpm (float): The Tavily searches per minute allowed.
+        _returns_: Clients: The client bundle.
+        """
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=HTTP_TIMEOUT,
+        )
+        # retries are left to the backend policies, which also see the failures of the other sessions
+        llm = ChatGroq(api_key=groq_api_key, model_name=model_name, http_client=http_client, max_retries=0)
+        draft_llm = ChatGroq(api_key=groq_api_key, model_name=draft_model_name, http_client=http_client, max_retries=0)
+        search_backend = Backend("Tavily", tavily_rpm)
+        api_wrapper = PooledTavilySearchAPIWrapper(tavily_api_key=tavily_api_key, pool_size=pool_size,
+                                                   backend=search_backend)
+        return cls(llm=llm, search=TavilySearchResults(api_wrapper=api_wrapper, max_results=2), draft_llm=draft_llm,
+                   llm_backend=Backend(f"Groq {model_name}", groq_rpm),
+                   draft_backend=Backend(f"Groq {draft_model_name}", groq_rpm), search_backend=search_backend)
+
+
+    @classmethod
+    def for_search(cls, tavily_api_key, pool_size=HTTP_POOL_SIZE, tavily_rpm=TAVILY_RPM):
+        """_summary_: Build a bundle with only the Tavily client, for work that looks up websites without an LLM.
+            _params_: tavily_api_key (str): The Tavily API key.
+            pool_size (int): The number of keep-alive connections kept open.
+            tavily_rpm (float): The Tavily searches per minute allowed.
+        _returns_: Clients: The client bundle, without LLMs.
+        """
+        search_backend = Backend("Tavily", tavily_rpm)
+        api_wrapper = PooledTavilySearchAPIWrapper(tavily_api_key=tavily_api_key, pool_size=pool_size,
+                                                   backend=search_backend)
+        return cls(llm=None, search=TavilySearchResults(api_wrapper=api_wrapper, max_results=2),
+                   search_backend=search_backend)
+
+# define the result classes returned by the pipeline
+@dataclass
+class ScrapeResult:
+    """_summary_: Title and description of a website, or the error that prevented the lookup."""
+    url: str
+    title: str
+    description: str
+    error: str = None
+    from_cache: bool = False
+
+    def as_dict(self):
+        """_summary_: Return the title and description as they are passed to the prompt."""
+        return {"title": self.title, "description": self.description}
+
+
+@dataclass
+class DocumentResult:
+    """_summary_: Text of an uploaded document, condensed if it does not fit the prompt, or the error that
+        prevented parsing it.
+    """
+    name: str
+    content: str = None
+    error: str = None
+    sha256: str = None
+    chunks: int = 0
+    condensed: bool = False
+    indexed: bool = False
+    from_cache: bool = False
+
+
+@dataclass
+class InsightResult:
+    """_summary_: Generated insights with the scraped data they are based on, or the error that prevented them."""
+    insights: str = None
+    error: str = None
+    fingerprint: str = None
+    from_cache: bool = False
+    company: ScrapeResult = None
+    competitors: list = field(default_factory=list)
+    prompt_tokens: int = None
+
+    @property
+    def scrape_errors(self):
+        """_summary_: Return the website lookups that failed."""
+        return [scrape for scrape in [self.company, *self.competitors] if scrape and scrape.error]
+
+    def as_dict(self):
+        """_summary_: Return the insights, error and failed lookups as JSON-serializable values, e.g. for a job result."""
+        return {
+            "insights": self.insights,
+            "error": self.error,
+            "fingerprint": self.fingerprint,
+            "from_cache": self.from_cache,
+            "prompt_tokens": self.prompt_tokens,
+            "scrape_errors": {scrape.url: scrape.error for scrape in self.scrape_errors},
+        }
+
+
+@dataclass
+class ReportResult:
+    """_summary_: Bytes of a generated report file (and its filename if it was written), or the error that
+        prevented it.
+    """
+    filename: str = None
+    data: bytes = None
+    error: str = None
+
+
+# define the InsightPipeline class
+class InsightPipeline:
+    """_summary_: Scrape, parse, generate and render sales insights without depending on Streamlit.
+        Errors are returned in the result objects instead of being shown, so the caller decides how to surface them.
+        The pipeline holds no per-request state, so one instance can be shared across threads.
+    """
+
+    def __init__(self, clients, logger=None, scrape_cache=None, insight_cache=None, passage_index=None,
+                 document_cache=None, renderer=None, metrics=None, max_workers=SCRAPE_MAX_WORKERS,
+                 timeout=SCRAPE_TIMEOUT):
+        """_summary_: Create a pipeline.
+            _params_: clients (Clients): The LLM, search and parser clients.
+            logger (logging.Logger): The logger to write to, defaults to the "sales_aipe" logger.
+            scrape_cache (ScrapeCache): Optional cache of website lookups.
+            insight_cache (InsightCache): Optional cache of generated insights.
+            passage_index (PassageIndex): Optional index of uploaded documents and generated insights. With it,
+                documents are indexed instead of condensed, and only their most relevant passages are prompted.
+            document_cache (DocumentCache): Optional cache of the text extracted from uploaded documents.
+            renderer (ReportRenderer): The renderer of the PDF, DOCX and HTML reports, a private one by default.
+            metrics (Metrics): The counters the stage timings are recorded in, a private set by default.
+            max_workers (int): The maximum number of website lookups running at the same time.
+            timeout (float): The number of seconds to wait for each URL before giving up on it.
+        """
+        self.clients = clients
+        self.logger = logger or logging.getLogger("sales_aipe")
+        self.scrape_cache = scrape_cache
+        self.insight_cache = insight_cache
+        self.passage_index = passage_index
+        self.document_cache = document_cache
+        self.renderer = renderer or ReportRenderer()
+        self.metrics = metrics or Metrics()
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    # define the scrape_website function
+    def scrape_website(self, url, trace=None, refresh=False):
+        """_summary_: Scrape the content and key information from a website URL, timing the lookup.
+            _params_: url (str): The URL of the website to scrape.
+            trace (list): Optional list the timing span of the lookup is appended to.
+            refresh (bool): Whether to look the website up again even if it is cached, e.g. to prefetch it.
+        _returns_: ScrapeResult: The title and description of the website content.
+        """
+        with self.metrics.span("scrape_website", trace, url=url) as span:
+            result = self._scrape_website(url, refresh)
+            span.update(status="error" if result.error else "ok", from_cache=result.from_cache)
+            return result
+
+    def _scrape_website(self, url, refresh=False):
+        try:
+            # if the url is empty, return a default message and return a message
+            if not url.strip():
+                self.logger.warning("No URL provided for scraping")
+                return ScrapeResult(url, "No URL provided", "No description available")
+            # serve the lookup from the cache if this URL was scraped recently
+            cached = None
+            if self.scrape_cache and not refresh:
+                # a cache that cannot be read, e.g. while another session holds the database lock, is skipped
+                try:
+                    cached = self.scrape_cache.get(url)
+                except Exception as e:
+                    self.logger.warning(f"Error reading website from cache {url}: {str(e)}")
+            if cached:
+                self.logger.info(f"Served website from cache: {url}")
+                return ScrapeResult(url, cached["title"], cached["description"], from_cache=True)
+            response = self.clients.search.invoke(f"summarize content and key information from {url}")
+            # the search tool returns its errors as text instead of raising them
+            if isinstance(response, str):
+                raise RuntimeError(response)
+            # if the response is not empty and has content, extract the title and description from the response and return it
+            if response and len(response) > 0:
+                content = response[0].get('content', 'No description available')
+                title = response[0].get('title', 'No title available')
+                self.logger.info(f"Successfully scraped website: {url}")
+                result = ScrapeResult(url, title, content)
+                # only successful lookups are cached, so failures are retried on the next request
+                if self.scrape_cache:
+                    try:
+                        self.scrape_cache.set(url, result.as_dict())
+                    except Exception as e:
+                        self.logger.warning(f"Error caching website {url}: {str(e)}")
+                return result
+            # if no data is found for the URL, return a message
+            self.logger.warning(f"No data found for URL: {url}")
+            return ScrapeResult(url, "No data found", "Could not fetch data from URL")
+        # if an exception occurs during the scraping process, log the error and return an error result
+        except Exception as e:
+            self.logger.error(f"Error scraping website {url}: {str(e)}")
+            return ScrapeResult(url, "Error", f"Error scraping website: {str(e)}", error=str(e))
+
+    # define the scrape_websites function
+    def scrape_websites(self, urls, trace=None):
+        """_summary_: Scrape several website URLs concurrently, keeping the results in the same order as the URLs.
+            _params_: urls (list): The URLs of the websites to scrape.
+            trace (list): Optional list the timing spans of the lookups are appended to.
+        _returns_: list: One ScrapeResult per URL.
+        """
+        if not urls:
+            return []
+        max_workers = max(1, min(self.max_workers, len(urls)))
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        started = {}
+
+        def scrape(index, url):
+            started[index] = time.monotonic()
+            return self.scrape_website(url, trace)
+
+        futures = [executor.submit(scrape, index, url) for index, url in enumerate(urls)]
+        # every lookup times out on its own, counted from when it starts; URLs beyond the concurrency cap
+        # start in later waves, and are given up on if the lookups ahead of them never free a worker
+        backstop = time.monotonic() + self.timeout * math.ceil(len(urls) / max_workers)
+        pending = set(range(len(urls)))
+        done = set()
+        while pending:
+            now = time.monotonic()
+            deadlines = {index: started[index] + self.timeout if index in started else backstop for index in pending}
+            pending = {index for index in pending if deadlines[index] > now}
+            if not pending:
+                break
+            finished, _ = wait([futures[index] for index in pending],
+                               timeout=min(deadlines[index] for index in pending) - now,
+                               return_when=FIRST_COMPLETED)
+            done |= finished
+            pending = {index for index in pending if futures[index] not in finished}
+        # don't wait for lookups that timed out, and drop the ones that never started
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        results = []
+        for url, future in zip(urls, futures):
+            if future in done:
+                results.append(future.result())
+            else:
+                error = f"Timed out after {self.timeout} seconds"
+                self.logger.error(f"Error scraping website {url}: {error}")
+                results.append(ScrapeResult(url, "Error", error, error=error))
+        return results
+
+    # define the parse_uploaded_file function
+    def parse_uploaded_file(self, file, chunk_tokens=DOCUMENT_CHUNK_TOKENS, digest_tokens=DOCUMENT_DIGEST_TOKENS,
+                            trace=None):
+        """_summary_: Parse the content of an uploaded PDF or DOCX file.
+            The document is read page by page into chunks, from the document cache if the same file was parsed
+            before. With a passage index, the chunks are indexed under the
+            file hash and the content is left empty; documents already in the index are not parsed again.
+            Without one, a document that fits in one chunk is returned as is, larger ones are condensed chunk by
+            chunk in parallel LLM calls and the digests merged.
+            _params_: file (File): The uploaded file object, with name and type attributes.
+            chunk_tokens (int): The maximum number of tokens of a chunk.
+            digest_tokens (int): The maximum number of tokens of the merged digest.
+            trace (list): Optional list the timing span of the parsing is appended to.
+        _returns_: DocumentResult: The text content of the file, or its digest. The content is None if the file
+            type is not supported.
+        """
+        with self.metrics.span("parse_uploaded_file", trace, file=file.name) as span:
+            result = self._parse_uploaded_file(file, chunk_tokens, digest_tokens)
+            span.update(status="error" if result.error else "ok", chunks=result.chunks,
+                        condensed=result.condensed, indexed=result.indexed, from_cache=result.from_cache)
+            return result
+
+    def _parse_uploaded_file(self, file, chunk_tokens, digest_tokens):
+        try:
+            # check the file type, only pdf and docx files are supported
+            if file.type not in SUPPORTED_MIME_TYPES:
+                # otherwise, log a warning for unsupported file types and return no content
+                self.logger.warning(f"Unsupported file type: {file.type}")
+                return DocumentResult(file.name)
+            sha256 = hashlib.sha256(file.getvalue()).hexdigest()
+            file_kind = "PDF" if file.type == PDF_MIME_TYPE else "DOCX"
+            if self.passage_index:
+                return self.index_document(file, file_kind, sha256)
+            pages, from_cache = self.read_pages(file, sha256)
+            chunks = iter_chunks(pages, chunk_tokens)
+            # look ahead one chunk to find out whether the document has to be condensed
+            first_chunks = list(itertools.islice(chunks, 2))
+            if len(first_chunks) < 2:
+                result = DocumentResult(file.name, first_chunks[0] if first_chunks else "", sha256=sha256,
+                                        chunks=len(first_chunks), from_cache=from_cache)
+            else:
+                content, count = self.condense_document(itertools.chain(first_chunks, chunks), chunk_tokens,
+                                                        digest_tokens)
+                result = DocumentResult(file.name, content, sha256=sha256, chunks=count, condensed=True,
+                                        from_cache=from_cache)
+            self.logger.info(f"Successfully parsed {file_kind} file: {file.name} ({result.chunks} chunks"
+                             f"{', condensed' if result.condensed else ''}{', cached text' if from_cache else ''})")
+            return result
+        # if an exception occurs during the parsing process, log the error and return an error result
+        except Exception as e:
+            self.logger.error(f"Error parsing file {file.name}: {str(e)}")
+            return DocumentResult(file.name, error=str(e))
+
+    # define the index_document function
+    def index_document(self, file, file_kind, sha256):
+        """_summary_: Store the passages of a document in the passage index, unless it is already there.
+            _params_: file (File): The uploaded file object.
+            file_kind (str): "PDF" or "DOCX", used in the log messages.
+            sha256 (str): The hash of the file bytes, the key of the document in the index.
+        _returns_: DocumentResult: The indexed document, without content.
+        """
+        indexed = self.passage_index.get_source(sha256)
+        if indexed:
+            self.logger.info(f"Document already indexed, skipped parsing {file_kind} file: {file.name}")
+            return DocumentResult(file.name, sha256=sha256, chunks=indexed["passages"], indexed=True)
+        pages, from_cache = self.read_pages(file, sha256)
+        count = self.passage_index.add(sha256, DOCUMENT, file.name, iter_chunks(pages, RETRIEVAL_CHUNK_TOKENS))
+        self.logger.info(f"Successfully parsed {file_kind} file: {file.name} ({count} chunks, indexed"
+                         f"{', cached text' if from_cache else ''})")
+        return DocumentResult(file.name, sha256=sha256, chunks=count, indexed=True, from_cache=from_cache)
+
+    # define the read_pages function
+    def read_pages(self, file, sha256):
+        """_summary_: Read the text of a document page by page, from the document cache if it was parsed before.
+            _params_: file (File): The uploaded file object.
+            sha256 (str): The hash of the file bytes, the key of the document in the cache.
+        _returns_: tuple: The iterable of page texts, and whether they come from the cache.
+        """
+        if self.document_cache is None:
+            return iter_pages(file, file.type), False
+        pages = self.document_cache.get(sha256)
+        if pages is not None:
+            return pages, True
+        return self._cache_pages(iter_pages(file, file.type), sha256), False
+
+    def _cache_pages(self, pages, sha256):
+        # the pages are passed on as they are extracted, and stored once the whole document is read
+        kept, size = [], 0
+        for text in pages:
+            if kept is not None:
+                size += len(text)
+                kept.append(text)
+                # stop keeping the pages of a document too large to cache
+                if size > self.document_cache.max_document_chars:
+                    kept = None
+            yield text
+        if kept is not None:
+            self.document_cache.set(sha256, kept)
+
+    # define the retrieve_context function
+    def retrieve_context(self, inputs, fingerprint):
+        """_summary_: Retrieve the passages of the uploaded document and of earlier insights relevant to a request.
+            _params_: inputs (dict): A dictionary containing the input data for generating insights.
+            fingerprint (str): The fingerprint of the request, its own earlier insights are skipped.
+        _returns_: tuple: The product document notes and the notes from earlier insights, as prompt text.
+        """
+        product_document = inputs.get('uploaded_file') or ""
+        past_insights = ""
+        if self.passage_index:
+            query = " ".join(inputs.get(name) or "" for name in
+                             ("product_name", "product_category", "value_proposition", "target_customer"))
+            if not product_document and inputs.get("uploaded_file_hash"):
+                passages = self.passage_index.search(query, RETRIEVAL_TOP_K, source=inputs["uploaded_file_hash"])
+                # a document that shares no words with the request is still passed on, from its beginning
+                if not passages:
+                    passages = self.passage_index.first_passages(inputs["uploaded_file_hash"], RETRIEVAL_TOP_K)
+                product_document = "\n".join(f"- {passage}" for passage in passages)
+            passages = self.passage_index.search(query, RETRIEVAL_INSIGHT_TOP_K, kind=INSIGHT,
+                                                 exclude_source=fingerprint)
+            past_insights = "\n".join(f"- {passage}" for passage in passages)
+        return product_document or "Not provided", past_insights or "None"
+
+    # define the condense_document function
+    def condense_document(self, chunks, chunk_tokens=DOCUMENT_CHUNK_TOKENS, digest_tokens=DOCUMENT_DIGEST_TOKENS):
+        """_summary_: Condense document chunks in parallel LLM calls (map), then merge the digests (reduce).
+            If the merged digest is still over budget, it is chunked and condensed again.
+            _params_: chunks (iterable): The document chunks, e.g. a generator from iter_chunks.
+            chunk_tokens (int): The maximum number of tokens of a chunk.
+            digest_tokens (int): The maximum number of tokens of the merged digest.
+        _returns_: tuple: The merged digest, and the number of chunks of the document.
+        """
+        chain = ChatPromptTemplate.from_template(CONDENSE_PROMPT) | self.clients.llm | self.clients.parser
+
+        def condense(chunk):
+            return self.call_llm(self.clients.llm, chain.invoke, {"text": chunk, "max_words": CHUNK_DIGEST_WORDS})
+
+        digests = map_ordered(condense, chunks, DOCUMENT_MAX_WORKERS)
+        count = len(digests)
+        digest = "\n".join(digests)
+        for _ in range(DOCUMENT_MAX_ROUNDS):
+            if estimate_tokens(digest) <= digest_tokens:
+                break
+            # merge the digests into fewer chunks, stop if they can no longer be packed together
+            groups = list(iter_chunks(digests, chunk_tokens))
+            if len(groups) >= len(digests):
+                break
+            digests = map_ordered(condense, groups, DOCUMENT_MAX_WORKERS)
+            digest = "\n".join(digests)
+        # never pass more than the budget to the insights prompt
+        return digest[:digest_tokens * CHARS_PER_TOKEN], count
+
+    # define the insights_fingerprint function
+    def insights_fingerprint(self, inputs, temperature, max_tokens, sectioned=False):
+        """_summary_: Compute the cache key of an insights request from its inputs and model settings.
+            _params_: inputs (dict): A dictionary containing the input data for generating insights.
+            temperature (float): The temperature parameter for the LLM model.
+            max_tokens (int): The maximum number of tokens to generate.
+            sectioned (bool): Whether the report is written one section per LLM call. Ignored below
+                SECTIONED_MIN_TOKENS, where the report is written in one call and shares the key of single-call reports.
+        _returns_: str: The fingerprint used as the key of the insight cache.
+        """
+        model_settings = {
+            "model": getattr(self.clients.llm, "model_name", None),
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "prompt_version": INSIGHTS_PROMPT_VERSION,
+        }
+        # only added when set, so the keys of single-call reports stay the same
+        if sectioned and max_tokens >= SECTIONED_MIN_TOKENS:
+            model_settings["sectioned"] = True
+        return InsightCache.fingerprint(inputs, model_settings)
+
+    # define the cached_insights function
+    def cached_insights(self, inputs, temperature, max_tokens, sectioned=False):
+        """_summary_: Look up the insights of an identical earlier request, without generating anything.
+            _params_: inputs (dict): A dictionary containing the input data for generating insights.
+            temperature (float): The temperature parameter for the LLM model.
+            max_tokens (int): The maximum number of tokens to generate.
+            sectioned (bool): Whether the report is written one section per LLM call.
+        _returns_: InsightResult: The cached insights, or None if the request was not answered before.
+        """
+        if not self.insight_cache:
+            return None
+        fingerprint = self.insights_fingerprint(inputs, temperature, max_tokens, sectioned)
+        cached = self.insight_cache.get(fingerprint)
+        if not cached:
+            return None
+        self.logger.info(f"Insights served from cache: {fingerprint}")
+        return InsightResult(insights=cached, fingerprint=fingerprint, from_cache=True)
+
+    # define the generate_insights function
+    def generate_insights(self, inputs, temperature, max_tokens, stream_handler=None, use_cache=True, trace=None,
+                          sectioned=False):
+        """_summary_: Generate insights for sales representatives based on the provided inputs.
+            _params_: inputs (dict): A dictionary containing the input data for generating insights.
+            temperature (float): The temperature parameter for the LLM model.
+            max_tokens (int): The maximum number of tokens to generate.
+            stream_handler (callable): Optional function that consumes the token stream and returns the full text,
+                e.g. st.write_stream. Without it the insights are generated in one blocking call.
+            use_cache (bool): Whether identical requests may be served from the insight cache.
+            trace (list): Optional list the timing spans of every stage are appended to.
+            sectioned (bool): Whether to write each section of the report in its own, concurrent LLM call.
+                Ignored when max_tokens is below SECTIONED_MIN_TOKENS.
+        _returns_: InsightResult: The generated insights as a formatted string, with the scraped data.
+        """
+        if sectioned and max_tokens < SECTIONED_MIN_TOKENS:
+            self.logger.warning(f"Writing the report in one call, {max_tokens} max tokens are too few for "
+                                f"{len(REPORT_SECTIONS)} sections of at least {SECTION_MIN_TOKENS} tokens")
+            sectioned = False
+        with self.metrics.span("generate_insights", trace, sectioned=sectioned) as span:
+            result = self._generate_insights(inputs, temperature, max_tokens, stream_handler, use_cache, trace,
+                                             sectioned)
+            span.update(status="error" if result.error else "ok", from_cache=result.from_cache)
+            return result
+
+    def _generate_insights(self, inputs, temperature, max_tokens, stream_handler, use_cache, trace, sectioned):
+        # serve identical requests from the insight cache
+        if use_cache:
+            cached = self.cached_insights(inputs, temperature, max_tokens, sectioned)
+            if cached:
+                return cached
+        fingerprint = self.insights_fingerprint(inputs, temperature, max_tokens, sectioned)
+
+        # if competitors are provided, collect the competitor URLs
+        competitor_urls = []
+        if inputs["competitors"]:
+            competitor_urls = [url.strip() for url in inputs["competitors"].split(",") if url.strip()]
+
+        # scrape the company website data and competitors data at the same time
+        company_data, *competitors_data = self.scrape_websites([inputs["company_url"]] + competitor_urls, trace)
+        result = InsightResult(fingerprint=fingerprint, company=company_data, competitors=competitors_data)
+
+        try:
+            with self.metrics.span("retrieve_context", trace):
+                product_document, past_insights = self.retrieve_context(inputs, fingerprint)
+            with self.metrics.span("build_prompt", trace) as span:
+                # fit the inputs and the scraped data into the prompt budget, competitor blurbs are trimmed first
+                prompt = fit_prompt(INSIGHTS_PROMPT, {
+                    "company_title": company_data.title,
+                    "company_description": company_data.description,
+                    "product_name": inputs['product_name'],
+                    "product_category": inputs['product_category'],
+                    "competitors_data": lambda budget: serialize_competitors(competitors_data, budget),
+                    "value_proposition": inputs['value_proposition'],
+                    "target_customer": inputs['target_customer'],
+                    "product_document": product_document,
+                    "past_insights": past_insights,
+                }, PROMPT_MAX_TOKENS, PROMPT_FIELD_BUDGETS)
+                chain_inputs = prompt.values
+                result.prompt_tokens = prompt_tokens = prompt.tokens
+                span.update(prompt_tokens=prompt_tokens, trimmed=prompt.trimmed)
+                self.logger.info(f"Insights prompt: {prompt_tokens} tokens"
+                                 + (f", trimmed {', '.join(prompt.trimmed)}" if prompt.trimmed else ""))
+            # generate insights using the LLM model and the fitted prompt, with the requested settings
+            if sectioned:
+                result.insights = self.generate_sections(chain_inputs, temperature, max_tokens, stream_handler, trace)
+            else:
+                result.insights = self.run_llm(self.clients.llm, INSIGHTS_PROMPT, chain_inputs, temperature,
+                                               max_tokens, stream_handler, prompt_tokens, trace)
+
+            # Log the generated insights
+            self.logger.info(f"Generated Insights:\n{result.insights}")
+        # if an exception occurs during the generation process, log the error and return an error result
+        except Exception as e:
+            self.logger.error(f"Error generating insights: {str(e)}")
+            result.insights = None
+            result.error = str(e)
+            return result
+
+        # the insights are kept even if they cannot be stored, e.g. while another session holds the database lock
+        if self.insight_cache and result.insights:
+            try:
+                self.insight_cache.set(fingerprint, result.insights)
+            except Exception as e:
+                self.logger.warning(f"Error caching insights: {str(e)}")
+        # index the insights so later requests for similar products can draw on them
+        if self.passage_index and result.insights:
+            try:
+                self.passage_index.add(fingerprint, INSIGHT, f"{inputs['product_name']} / {inputs['company_url']}",
+                                       iter_chunks(result.insights.split("\n\n"), RETRIEVAL_CHUNK_TOKENS))
+            except Exception as e:
+                self.logger.warning(f"Error indexing insights: {str(e)}")
+        return result
+
+    # define the call_llm function
+    def call_llm(self, llm, func, *args, **kwargs):
+        """_summary_: Make an LLM call under the rate limit, retry and circuit breaker policy of its backend.
+            _params_: llm (BaseChatModel): The model that is called, used to find its backend.
+            func (callable): The call, e.g. chain.invoke.
+            args: The positional arguments of the call.
+            kwargs: The keyword arguments of the call.
+        _returns_: object: The result of the call.
+        """
+        backend = self.clients.backend_for(llm)
+        if backend is None:
+            return func(*args, **kwargs)
+        return backend.call(func, *args, **kwargs)
+
+    # define the run_llm function
+    def run_llm(self, llm, template, chain_inputs, temperature, max_tokens, stream_handler=None, prompt_tokens=None,
+                trace=None):
+        """_summary_: Run a prompt through an LLM with the requested settings, timing the call and counting tokens.
+            _params_: llm (BaseChatModel): The model to call.
+            template (str): The prompt template.
+            chain_inputs (dict): The values of the prompt template.
+            temperature (float): The temperature parameter for the LLM model.
+            max_tokens (int): The maximum number of tokens to generate.
+            stream_handler (callable): Optional function that consumes the token stream and returns the full text.
+            prompt_tokens (int): The size of the prompt, used when the model does not report its usage.
+            trace (list): Optional list the timing span of the call is appended to.
+        _returns_: str: The generated text.
+        """
+        # define the chain of tools, binding the settings of this request to the shared model
+        chain = (ChatPromptTemplate.from_template(template)
+                 | llm.bind(temperature=temperature, max_tokens=max_tokens)
+                 | self.clients.parser)
+        model = getattr(llm, "model_name", None)
+        with self.metrics.span("llm", trace, model=model, streamed=bool(stream_handler)) as span:
+            # collect the token counts reported by the model
+            usage = UsageMetadataCallbackHandler()
+            config = {"callbacks": [usage]}
+            if stream_handler:
+                start = time.perf_counter()
+
+                def open_stream():
+                    # rate limits and connection errors surface before the first token, so only opening the stream
+                    # is retried, never a stream the caller has started to consume
+                    chunks = chain.stream(chain_inputs, config=config)
+                    first = next(chunks, None)
+                    return itertools.chain([] if first is None else [first], chunks)
+
+                # hand the token stream to the caller, which returns the full text at the end
+                text = stream_handler(timed_stream(self.call_llm(llm, open_stream), span, start))
+            else:
+                text = self.call_llm(llm, chain.invoke, chain_inputs, config=config)
+            # fall back to estimates when the model does not report its usage
+            reported = list(usage.usage_metadata.values())
+            span["input_tokens"] = sum(u.get("input_tokens", 0) for u in reported) or prompt_tokens
+            span["output_tokens"] = (sum(u.get("output_tokens", 0) for u in reported)
+                                     or estimate_tokens(text or ""))
+        return text
+
+    # define the generate_sections function
+    def generate_sections(self, chain_inputs, temperature, max_tokens, stream_handler=None, trace=None):
+        """_summary_: Write every section of the report in its own LLM call, all at the same time.
+            The sections share the fitted prompt values and are assembled in the order of REPORT_SECTIONS.
+            A section that fails with a transient error is retried on its own.
+            _params_: chain_inputs (dict): The fitted values of the insights prompt.
+            temperature (float): The temperature parameter for the LLM model.
+            max_tokens (int): The maximum number of tokens of the whole report, shared between the sections.
+            stream_handler (callable): Optional function that consumes the sections as they are ready, in order,
+                and returns the full text.
+            trace (list): Optional list the timing spans of the sections are appended to.
+        _returns_: str: The assembled report.
+        """
+        # the sections together stay within max_tokens
+        section_tokens = max_tokens // len(REPORT_SECTIONS)
+
+        def write_section(title):
+            with self.metrics.span("generate_section", trace, section=title) as span:
+                for attempt in range(SECTION_RETRIES + 1):
+                    try:
+                        return self.run_llm(self.clients.llm, SECTION_PROMPTS[title], chain_inputs, temperature,
+                                            section_tokens, trace=trace).strip()
+                    except Exception as e:
+                        # bad requests would fail again, and an open circuit refuses the retry anyway
+                        if attempt == SECTION_RETRIES or isinstance(e, CircuitOpenError) or not is_retryable(e):
+                            raise
+                        span["retries"] = attempt + 1
+                        self.logger.warning(f"Retrying section {title} after error: {str(e)}")
+
+        with ThreadPoolExecutor(max_workers=len(REPORT_SECTIONS)) as executor:
+            futures = [executor.submit(write_section, title) for title, _ in REPORT_SECTIONS]
+
+            def assembled():
+                # each section is passed on as soon as it and the ones before it are ready
+                for i, future in enumerate(futures):
+                    yield ("\n\n" if i else "") + future.result()
+
+            if stream_handler:
+                return stream_handler(assembled())
+            return "".join(assembled())
+
+    # define the generate_draft function
+    def generate_draft(self, inputs, temperature, max_tokens=DRAFT_MAX_TOKENS, stream_handler=None, trace=None):
+        """_summary_: Write a short first draft (overview and pitch) with the fast draft model, without scraping.
+            It is meant to be shown while generate_insights writes the full report.
+            _params_: inputs (dict): A dictionary containing the input data for generating insights.
+            temperature (float): The temperature parameter for the LLM model.
+            max_tokens (int): The maximum number of tokens of the draft.
+            stream_handler (callable): Optional function that consumes the token stream and returns the full text.
+            trace (list): Optional list the timing spans of the draft are appended to.
+        _returns_: InsightResult: The draft as the insights, or the error that prevented it.
+        """
+        with self.metrics.span("generate_draft", trace) as span:
+            result = InsightResult()
+            try:
+                product_document, _ = self.retrieve_context(inputs, None)
+                prompt = fit_prompt(DRAFT_PROMPT, {
+                    "company_url": inputs['company_url'],
+                    "product_name": inputs['product_name'],
+                    "product_category": inputs['product_category'],
+                    "competitors": inputs['competitors'] or "None",
+                    "value_proposition": inputs['value_proposition'],
+                    "target_customer": inputs['target_customer'],
+                    "product_document": product_document,
+                }, DRAFT_PROMPT_MAX_TOKENS, DRAFT_FIELD_BUDGETS)
+                result.prompt_tokens = prompt.tokens
+                result.insights = self.run_llm(self.clients.draft_llm or self.clients.llm, DRAFT_PROMPT,
+                                               prompt.values, temperature, min(max_tokens, DRAFT_MAX_TOKENS),
+                                               stream_handler, prompt.tokens, trace)
+                self.logger.info(f"Generated draft:\n{result.insights}")
+            except Exception as e:
+                self.logger.error(f"Error generating draft: {str(e)}")
+                result.insights = None
+                result.error = str(e)
+            span["status"] = "error" if result.error else "ok"
+            return result
+
+    # define the generate_pdf function
+    def generate_pdf(self, content, filename=None, trace=None):
+        """_summary_: Generate a PDF document with the provided content, in memory.
+            _params_: content (str): The content to be included in the PDF file.
+            filename (str): Optional filename the PDF is also written to.
+            trace (list): Optional list the timing span of the rendering is appended to.
+        _returns_: ReportResult: The bytes of the PDF document, and the filename if it was written.
+        """
+        return self.generate_report(content, "pdf", filename, trace=trace)
+
+    # define the generate_report function
+    def generate_report(self, content, report_format="pdf", filename=None, title=None, trace=None):
+        """_summary_: Render the markdown insights as a PDF, DOCX or HTML report, in memory.
+            The report is parsed once for all formats, and a report rendered before is served from the renderer.
+            _params_: content (str): The markdown content of the report.
+            report_format (str): "pdf", "docx" or "html".
+            filename (str): Optional filename the report is also written to.
+            title (str): Optional title shown above the report.
+            trace (list): Optional list the timing span of the rendering is appended to.
+        _returns_: ReportResult: The bytes of the report, and the filename if it was written.
+        """
+        with self.metrics.span(f"generate_{report_format}", trace) as span:
+            result = self._generate_report(content, report_format, filename, title)
+            span.update(status="error" if result.error else "ok", bytes=len(result.data or b""))
+            return result
+
+    def _generate_report(self, content, report_format, filename, title):
+        try:
+            data = self.renderer.render(content, report_format, title)
+            if filename:
+                with open(filename, "wb") as f:
+                    f.write(data)
+            self.logger.info(f"Successfully generated {report_format.upper()}: "
+                             f"{filename or f'{len(data)} bytes in memory'}")
+            return ReportResult(filename, data)
+        except Exception as e:
+            self.logger.error(f"Error generating {report_format.upper()}: {str(e)}")
+            return ReportResult(error=str(e))
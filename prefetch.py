@@ -0,0 +1,162 @@
+# import necessary libraries
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from batch import read_accounts
+from log_index import LogIndex, parse_since
+from pipeline import TAVILY_RPM, Clients, InsightPipeline
+from result_cache import ScrapeCache, normalize_url
+
+PREFETCH_REFRESH_AFTER = 12 * 60 * 60  # seconds after which a cached website is looked up again
+# Tavily rate of the prefetch; it is limited on its own, apart from the app's TAVILY_RPM, so the two add up while
+# both run. Keep the prefetch in an off-peak --window, or lower it, to stay under the Tavily plan's limit.
+PREFETCH_TAVILY_RPM = TAVILY_RPM / 2
+
+logger = logging.getLogger("sales_aipe.prefetch")
+
+
+# define the read_territory function
+def read_territory(path):
+    """_summary_: Read the websites of a territory, from a text file of URLs or from a batch accounts file.
+        _params_: path (str): A .txt file with one URL per line, or a JSONL or CSV file of accounts as read by
+            batch.read_accounts, whose company and competitor URLs are used.
+    _returns_: list: The URLs, in file order.
+    """
+    if path.lower().endswith(".txt"):
+        with open(path, encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    urls = []
+    for account in read_accounts(path):
+        urls.append(account["company_url"])
+        urls.extend(url.strip() for url in account["competitors"].split(","))
+    return [url for url in urls if url]
+
+
+# define the requested_urls function
+def requested_urls(log_index, since, top):
+    """_summary_: Find the websites requested most often in the session logs, through the log index.
+        Only the log lines written since the last update of the index are read.
+        _params_: log_index (LogIndex): The index of the session logs.
+        since (str): The earliest time included, in the stored time format.
+        top (int): The number of websites to return.
+    _returns_: list: The URLs, most requested first.
+    """
+    log_index.update()
+    _, rows = log_index.top_domains(since, top)
+    return [row[0] for row in rows]
+
+
+# define the in_window function
+def in_window(now, window):
+    """_summary_: Check whether a time falls in an off-peak window of hours, which may span midnight.
+        _params_: now (datetime): The time to check.
+        window (tuple): The first hour of the window and the hour it ends, e.g. (22, 6), or None for always.
+    _returns_: bool: True if the time is in the window.
+    """
+    if window is None:
+        return True
+    start, end = window
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+# define the wait_for_window function
+def wait_for_window(window):
+    """_summary_: Sleep until the off-peak window opens, if it is not open yet.
+        _params_: window (tuple): The first hour of the window and the hour it ends, or None for always.
+    """
+    now = datetime.now()
+    if in_window(now, window):
+        return
+    opens = now.replace(hour=window[0], minute=0, second=0, microsecond=0)
+    if opens <= now:
+        opens += timedelta(days=1)
+    logger.info(f"Waiting for the off-peak window to open at {opens:%Y-%m-%d %H:%M}")
+    time.sleep((opens - now).total_seconds())
+
+
+# define the prefetch_websites function
+def prefetch_websites(pipeline, urls, refresh_after=PREFETCH_REFRESH_AFTER, workers=4, window=None):
+    """_summary_: Look up the websites of a territory ahead of time and store them in the website lookup cache,
+        so the requests of the reps find them there and go straight to the LLM.
+        Websites cached more recently than refresh_after are left alone. The lookups go through the rate limit,
+        retry and circuit breaker policy of the search backend, and no new lookup starts once the window closes.
+        _params_: pipeline (InsightPipeline): The pipeline whose scrape cache is filled.
+        urls (list): The URLs of the websites, duplicates are looked up once.
+        refresh_after (float): The seconds after which a cached website is looked up again.
+        workers (int): The number of lookups running at the same time.
+        window (tuple): The first hour of the off-peak window and the hour it ends, or None for always.
+    _returns_: dict: The number of websites refreshed, still fresh, failed and skipped because the window closed.
+    """
+    unique = {}
+    for url in urls:
+        unique.setdefault(normalize_url(url), url)
+    summary = {"refreshed": 0, "fresh": 0, "error": 0, "skipped": 0}
+    pending = []
+    for url in unique.values():
+        age = pipeline.scrape_cache.age(url)
+        if age is not None and age < refresh_after:
+            summary["fresh"] += 1
+        else:
+            pending.append(url)
+    logger.info(f"Prefetching {len(pending)} websites, {summary['fresh']} still fresh in the cache")
+
+    def prefetch(url):
+        if not in_window(datetime.now(), window):
+            return "skipped"
+        return "error" if pipeline.scrape_website(url, refresh=True).error else "refreshed"
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(prefetch, url): url for url in pending}
+        for future in as_completed(futures):
+            status = future.result()
+            summary[status] += 1
+            if status != "skipped":
+                logger.info(f"[{summary['refreshed'] + summary['error']}/{len(pending)}] {futures[future]}: {status}")
+    return summary
+
+
+# define the main function for the command line
+def main():
+    arg_parser = argparse.ArgumentParser(description="Prefetch the websites of a territory into the website lookup "
+                                                     "cache. Run it off-peak, e.g. nightly from cron.")
+    arg_parser.add_argument("territory", nargs="?",
+                            help="text file with one URL per line, or JSONL or CSV file of accounts")
+    arg_parser.add_argument("--log-dir", help="also prefetch the websites requested most in these session logs")
+    arg_parser.add_argument("--top", type=int, default=100, help="number of websites taken from the session logs")
+    arg_parser.add_argument("--since", default="30d",
+                            help="only count requests this recent in the session logs, e.g. 7d or 2024-12-11")
+    arg_parser.add_argument("--log-db", default="cache/log_index.sqlite3", help="path of the log index database")
+    arg_parser.add_argument("--refresh-after", type=float, default=PREFETCH_REFRESH_AFTER / 3600,
+                            help="hours after which a cached website is looked up again")
+    arg_parser.add_argument("--window", help="off-peak hours to run in, e.g. 22-6; waits for the window to open")
+    arg_parser.add_argument("-w", "--workers", type=int, default=4, help="number of lookups running at the same time")
+    arg_parser.add_argument("--tavily-rpm", type=float, default=PREFETCH_TAVILY_RPM,
+                            help="maximum Tavily requests per minute")
+    args = arg_parser.parse_args()
+    if not args.territory and not args.log_dir:
+        arg_parser.error("give a territory file, --log-dir, or both")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    window = tuple(int(hour) for hour in args.window.split("-")) if args.window else None
+    urls = read_territory(args.territory) if args.territory else []
+    if args.log_dir:
+        urls += requested_urls(LogIndex(args.log_db, args.log_dir), parse_since(args.since), args.top)
+    # the prefetch only looks up websites, so it needs no Groq key
+    clients = Clients.for_search(os.environ["TAVILY_API_KEY"], tavily_rpm=args.tavily_rpm)
+    pipeline = InsightPipeline(clients, logger=logger, scrape_cache=ScrapeCache())
+
+    wait_for_window(window)
+    summary = prefetch_websites(pipeline, urls, refresh_after=args.refresh_after * 3600, workers=args.workers,
+                                window=window)
+    logger.info(f"Done: {summary['refreshed']} refreshed, {summary['fresh']} still fresh, {summary['error']} failed, "
+                f"{summary['skipped']} skipped after the window closed")
+
+
+if __name__ == "__main__":
+    main()
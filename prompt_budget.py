@@ -0,0 +1,141 @@
+# import necessary libraries
+import functools
+import logging
+from dataclasses import dataclass, field
+from documents import CHARS_PER_TOKEN, estimate_tokens
+
+# tiktoken is optional, without it token counts are estimated from the text length
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# tiktoken has no Llama encoding, cl100k_base is the closest of the encodings it ships
+TOKEN_ENCODING = "cl100k_base"
+TRUNCATION_MARK = " ..."
+
+logger = logging.getLogger("sales_aipe.prompt_budget")
+
+
+# define a function to load the tokenizer
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """_summary_: Load the tokenizer once, or return None if tiktoken is missing or cannot load its encoding."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        # the encoding is downloaded on first use, which fails on machines without network access
+        logger.warning(f"Falling back to estimated token counts: {e}")
+        return None
+
+
+# define the count_tokens function
+def count_tokens(text):
+    """_summary_: Count the tokens of a text with tiktoken, or estimate them if it is not available.
+        _params_: text (str): The text to measure.
+    _returns_: int: The number of tokens.
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# define the truncate_tokens function
+def truncate_tokens(text, max_tokens):
+    """_summary_: Cut a text to at most max_tokens tokens, at a word boundary, marking that it was cut.
+        _params_: text (str): The text to cut.
+        max_tokens (int): The maximum number of tokens to keep.
+    _returns_: str: The text, unchanged if it already fits.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(TRUNCATION_MARK)
+    if budget <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        head = text[:budget * CHARS_PER_TOKEN]
+    else:
+        head = encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+    # drop the partial last word
+    if " " in head.strip():
+        head = head.rstrip().rsplit(" ", 1)[0]
+    return head.rstrip(" ,;:-") + TRUNCATION_MARK
+
+
+# define the serialize_competitors function
+def serialize_competitors(competitors, max_tokens):
+    """_summary_: Write the competitor lookups as one compact line each, sharing the budget between them.
+        The names of the competitors are always kept, even when they alone are over the budget.
+        _params_: competitors (list): The ScrapeResult of each competitor.
+        max_tokens (int): The maximum number of tokens of all competitors together.
+    _returns_: str: One "- title: description" line per competitor, or "None" if there are no competitors.
+    """
+    if not competitors:
+        return "None"
+    share = max_tokens // len(competitors)
+    lines = []
+    for competitor in competitors:
+        name = f"- {' '.join(competitor.title.split())}"
+        # keep at least the names when the share is too small for the descriptions
+        if count_tokens(name) + 4 > share:
+            lines.append(name)
+        else:
+            lines.append(truncate_tokens(f"{name}: {' '.join(competitor.description.split())}", share))
+    text = "\n".join(lines)
+    if count_tokens(text) > max_tokens:
+        # fall back to the names only, the smallest the competitors get
+        text = "\n".join(f"- {' '.join(competitor.title.split())}" for competitor in competitors)
+    return text
+
+
+# define the BudgetedPrompt class
+@dataclass
+class BudgetedPrompt:
+    """_summary_: Prompt values that fit a token budget, with the size of the resulting prompt."""
+    values: dict
+    tokens: int
+    trimmed: list = field(default_factory=list)
+
+
+# define the fit_prompt function
+def fit_prompt(template, values, max_tokens, field_budgets):
+    """_summary_: Fit the values of a prompt template into a token budget.
+        Every budgeted field is first cut to its own budget. If the prompt is still over max_tokens, the
+        budgeted fields are shrunk further in the order of field_budgets, so the first fields listed lose
+        their text first. A field rendered by a function keeps the smallest text the function renders, and
+        fields without a budget are kept as they are, so a warning is logged if the prompt stays over max_tokens.
+        _params_: template (str): The prompt template, with {name} placeholders.
+        values (dict): The value of each placeholder. A budgeted field may be a function that renders its text
+            for a token budget, e.g. to condense a list instead of cutting it off.
+        max_tokens (int): The maximum number of tokens of the whole prompt.
+        field_budgets (dict): The maximum number of tokens of each budgeted field, in the order they are trimmed.
+    _returns_: BudgetedPrompt: The fitted values and the number of tokens of the prompt.
+    """
+    def render(name, budget):
+        value = values[name]
+        return value(budget) if callable(value) else truncate_tokens(value, budget)
+
+    fitted = dict(values)
+    sizes = {}
+    for name, budget in field_budgets.items():
+        fitted[name] = render(name, budget)
+        sizes[name] = count_tokens(fitted[name])
+    tokens = count_tokens(template.format(**fitted))
+    trimmed = [name for name in field_budgets if not callable(values[name]) and fitted[name] != values[name]]
+
+    for name in field_budgets:
+        overflow = tokens - max_tokens
+        if overflow <= 0:
+            break
+        fitted[name] = render(name, max(sizes[name] - overflow, 0)) or "Omitted"
+        if name not in trimmed:
+            trimmed.append(name)
+        tokens = count_tokens(template.format(**fitted))
+    if tokens > max_tokens:
+        # only fields without a budget, or the floors of rendered fields, are left to blame
+        logger.warning(f"Prompt is {tokens} tokens after trimming, over the budget of {max_tokens}")
+    return BudgetedPrompt(fitted, tokens, trimmed)
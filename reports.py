@@ -0,0 +1,356 @@
+# import necessary libraries
+import hashlib
+import html
+import io
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+import docx
+from docx.shared import Pt
+from fpdf import FPDF
+from documents import DOCX_MIME_TYPE
+
+# output formats of the reports, with their MIME type and file extension
+REPORT_FORMATS = {
+    "pdf": ("application/pdf", ".pdf"),
+    "docx": (DOCX_MIME_TYPE, ".docx"),
+    "html": ("text/html", ".html"),
+}
+RENDER_CACHE_MAX_ENTRIES = 256  # rendered reports kept in memory, per renderer
+
+# markdown syntax recognized in the reports written by the LLM
+HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*$")
+BULLET = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+NUMBERED = re.compile(r"^(\s*)(\d+)[.)]\s+(.*)$")
+RULE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$")
+INLINE = re.compile(r"\*\*\*(.+?)\*\*\*|\*\*(.+?)\*\*|__(.+?)__|\*([^*\s][^*]*?)\*|`([^`]+)`|\[([^\]]+)\]\(([^)\s]+)\)")
+
+
+# define the classes of the intermediate document model
+@dataclass(frozen=True)
+class Run:
+    """_summary_: Piece of text of a block with one style."""
+    text: str
+    bold: bool = False
+    italic: bool = False
+
+
+@dataclass(frozen=True)
+class Block:
+    """_summary_: Heading, paragraph, list item or horizontal rule of a report.
+        The level is the heading level (1 to 6) or the nesting depth of a list item (0 for the outer list).
+    """
+    kind: str
+    runs: tuple = ()
+    level: int = 0
+    number: str = None
+
+    @property
+    def text(self):
+        """_summary_: Return the text of the block without its styles."""
+        return "".join(run.text for run in self.runs)
+
+
+@dataclass(frozen=True)
+class ReportDocument:
+    """_summary_: Report parsed from markdown once, and rendered from there into every output format."""
+    title: str
+    blocks: tuple
+
+
+# define the parse_inline function
+def parse_inline(text):
+    """_summary_: Split the text of a block into runs of bold, italic and plain text.
+        Inline code keeps its text, and links are written as their text followed by the URL.
+        _params_: text (str): The markdown text of the block.
+    _returns_: tuple: The runs of the text.
+    """
+    runs = []
+    position = 0
+    for match in INLINE.finditer(text):
+        if match.start() > position:
+            runs.append(Run(text[position:match.start()]))
+        bold_italic, bold, underscore_bold, italic, code, link_text, link_url = match.groups()
+        if bold_italic:
+            runs.extend(Run(run.text, True, True) for run in parse_inline(bold_italic))
+        elif bold or underscore_bold:
+            runs.extend(Run(run.text, True, run.italic) for run in parse_inline(bold or underscore_bold))
+        elif italic:
+            runs.append(Run(italic, italic=True))
+        elif code:
+            runs.append(Run(code))
+        else:
+            runs.append(Run(f"{link_text} ({link_url})"))
+        position = match.end()
+    if position < len(text):
+        runs.append(Run(text[position:]))
+    return tuple(runs)
+
+
+# define the parse_markdown function
+def parse_markdown(markdown, title=None):
+    """_summary_: Parse a markdown report into the intermediate document model.
+        Consecutive text lines are joined into one paragraph, so the section structure written by the LLM is kept
+        while its line wrapping is not.
+        _params_: markdown (str): The report.
+        title (str): Optional title shown above the report.
+    _returns_: ReportDocument: The parsed report.
+    """
+    blocks = []
+    paragraph = []
+    list_indents = []
+
+    def end_paragraph():
+        if paragraph:
+            blocks.append(Block("paragraph", parse_inline(" ".join(paragraph))))
+            paragraph.clear()
+
+    def list_level(indent):
+        # the depth of an item is the number of shallower items it is nested under
+        while list_indents and list_indents[-1] > indent:
+            list_indents.pop()
+        if not list_indents or list_indents[-1] < indent:
+            list_indents.append(indent)
+        return len(list_indents) - 1
+
+    for line in markdown.splitlines():
+        stripped = line.strip()
+        heading = HEADING.match(stripped)
+        bullet = BULLET.match(line)
+        numbered = NUMBERED.match(line)
+        if not stripped:
+            end_paragraph()
+        elif RULE.match(line):
+            end_paragraph()
+            list_indents.clear()
+            blocks.append(Block("rule"))
+        elif heading:
+            end_paragraph()
+            list_indents.clear()
+            blocks.append(Block("heading", parse_inline(heading.group(2)), level=len(heading.group(1))))
+        elif bullet:
+            end_paragraph()
+            indent = len(bullet.group(1).expandtabs(4))
+            blocks.append(Block("bullet", parse_inline(bullet.group(2)), level=list_level(indent)))
+        elif numbered:
+            end_paragraph()
+            indent = len(numbered.group(1).expandtabs(4))
+            blocks.append(Block("numbered", parse_inline(numbered.group(3)), level=list_level(indent),
+                                number=numbered.group(2)))
+        elif stripped.startswith("|"):
+            # table rows are kept one per line, their separator row is dropped
+            end_paragraph()
+            if not TABLE_SEPARATOR.match(stripped):
+                cells = [cell.strip() for cell in stripped.strip("|").split("|")]
+                blocks.append(Block("paragraph", parse_inline(" | ".join(cells))))
+        elif list_indents and line[:1].isspace() and blocks and blocks[-1].kind in ("bullet", "numbered"):
+            # continuation line of a list item
+            item = blocks.pop()
+            blocks.append(Block(item.kind, item.runs + parse_inline(" " + stripped), item.level, item.number))
+        else:
+            if not paragraph:
+                list_indents.clear()
+            paragraph.append(stripped)
+    end_paragraph()
+    return ReportDocument(title, tuple(blocks))
+
+
+# define the PdfLayout class
+@dataclass(frozen=True)
+class PdfLayout:
+    """_summary_: Fonts, sizes and spacing of the PDF reports, set up once per renderer."""
+    font: str = "Arial"
+    title_size: int = 16
+    heading_sizes: tuple = (14, 12, 11, 10, 10, 10)
+    body_size: int = 10
+    line_height: float = 5.5
+    paragraph_spacing: float = 2.5
+    list_indent: float = 6
+    margin: float = 15
+
+
+# define the ReportRenderer class
+class ReportRenderer:
+    """_summary_: Renders markdown reports into PDF, DOCX and HTML from one parsed document model.
+        The parsed documents and the rendered files are kept in bounded LRU caches keyed by the hash of the report,
+        so exporting a report in several formats, or again, parses and lays it out only once.
+    """
+
+    def __init__(self, layout=None, max_entries=RENDER_CACHE_MAX_ENTRIES):
+        """_summary_: Create a renderer.
+            _params_: layout (PdfLayout): The fonts and spacing of the PDF reports.
+            max_entries (int): The number of parsed documents, and of rendered files, kept in memory.
+        """
+        self.layout = layout or PdfLayout()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._documents = OrderedDict()
+        self._rendered = OrderedDict()
+
+    def _cached(self, cache, key, build):
+        """_summary_: Return a cached value, building and storing it on a miss."""
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = build()
+        with self._lock:
+            cache[key] = value
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+        return value
+
+    def parse(self, markdown, title=None):
+        """_summary_: Parse a report, or return its parsed document if it was parsed before.
+            _params_: markdown (str): The report.
+            title (str): Optional title shown above the report.
+        _returns_: ReportDocument: The parsed report.
+        """
+        key = (hashlib.sha256(markdown.encode("utf-8")).hexdigest(), title)
+        return self._cached(self._documents, key, lambda: parse_markdown(markdown, title))
+
+    def render(self, markdown, report_format="pdf", title=None):
+        """_summary_: Render a report in one of the REPORT_FORMATS, or return the file rendered before.
+            _params_: markdown (str): The report.
+            report_format (str): "pdf", "docx" or "html".
+            title (str): Optional title shown above the report.
+        _returns_: bytes: The rendered file.
+        """
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"Unsupported report format: {report_format}")
+        key = (hashlib.sha256(markdown.encode("utf-8")).hexdigest(), title, report_format)
+        render = getattr(self, f"render_{report_format}")
+        return self._cached(self._rendered, key, lambda: render(self.parse(markdown, title)))
+
+    def render_pdf(self, document):
+        """_summary_: Lay out a parsed report as a PDF file, block by block, breaking pages as they fill up.
+            _params_: document (ReportDocument): The parsed report.
+        _returns_: bytes: The PDF file.
+        """
+        layout = self.layout
+        pdf = FPDF()
+        pdf.set_margins(layout.margin, layout.margin, layout.margin)
+        pdf.set_auto_page_break(auto=True, margin=layout.margin)
+        pdf.add_page()
+        if document.title:
+            pdf.set_font(layout.font, "B", layout.title_size)
+            pdf.multi_cell(0, layout.title_size * 0.6, _pdf_text(document.title), align="C")
+            pdf.ln(layout.paragraph_spacing * 2)
+        for block in document.blocks:
+            if block.kind == "rule":
+                pdf.ln(layout.paragraph_spacing)
+                pdf.line(layout.margin, pdf.get_y(), pdf.w - layout.margin, pdf.get_y())
+                pdf.ln(layout.paragraph_spacing)
+            elif block.kind == "heading":
+                size = layout.heading_sizes[block.level - 1]
+                pdf.ln(layout.paragraph_spacing)
+                pdf.set_font(layout.font, "B", size)
+                pdf.multi_cell(0, size * 0.55, _pdf_text(block.text))
+                pdf.ln(layout.paragraph_spacing / 2)
+            else:
+                indent = 0
+                if block.kind in ("bullet", "numbered"):
+                    indent = layout.list_indent * (block.level + 1)
+                    marker = "\x95" if block.kind == "bullet" else f"{block.number}."
+                    pdf.set_x(layout.margin + indent - layout.list_indent)
+                    pdf.set_font(layout.font, "", layout.body_size)
+                    pdf.cell(layout.list_indent, layout.line_height, marker)
+                # wrapped lines of the block start at its indent
+                pdf.set_left_margin(layout.margin + indent)
+                for run in block.runs:
+                    pdf.set_font(layout.font, ("B" if run.bold else "") + ("I" if run.italic else ""), layout.body_size)
+                    pdf.write(layout.line_height, _pdf_text(run.text))
+                pdf.set_left_margin(layout.margin)
+                pdf.ln(layout.line_height + (layout.paragraph_spacing if block.kind == "paragraph" else 0.5))
+        # FPDF returns the document as a latin-1 string when asked for it in memory
+        return pdf.output(dest="S").encode("latin-1")
+
+    def render_docx(self, document):
+        """_summary_: Write a parsed report as a Word document, with heading and list styles.
+            _params_: document (ReportDocument): The parsed report.
+        _returns_: bytes: The DOCX file.
+        """
+        word = docx.Document()
+        word.styles["Normal"].font.size = Pt(self.layout.body_size + 1)
+        if document.title:
+            word.add_heading(document.title, level=0)
+        for block in document.blocks:
+            if block.kind == "heading":
+                paragraph = word.add_heading(level=min(block.level, 9))
+            elif block.kind in ("bullet", "numbered"):
+                style = "List Bullet" if block.kind == "bullet" else "List Number"
+                paragraph = word.add_paragraph(style=style if block.level == 0 else f"{style} {min(block.level + 1, 3)}")
+            elif block.kind == "rule":
+                word.add_paragraph("_" * 40)
+                continue
+            else:
+                paragraph = word.add_paragraph()
+            for run in block.runs:
+                word_run = paragraph.add_run(run.text)
+                word_run.bold = run.bold or None
+                word_run.italic = run.italic or None
+        data = io.BytesIO()
+        word.save(data)
+        return data.getvalue()
+
+    def render_html(self, document):
+        """_summary_: Write a parsed report as a standalone HTML page, nesting the list items.
+            _params_: document (ReportDocument): The parsed report.
+        _returns_: bytes: The UTF-8 encoded HTML page.
+        """
+        parts = ["<!DOCTYPE html>", '<html><head><meta charset="utf-8">',
+                 f"<title>{html.escape(document.title or 'Account Insights')}</title>",
+                 "<style>body{font-family:Arial,sans-serif;max-width:50em;margin:2em auto;line-height:1.5}</style>",
+                 "</head><body>"]
+        if document.title:
+            parts.append(f"<h1>{html.escape(document.title)}</h1>")
+        open_lists = []
+        for block in document.blocks:
+            depth = block.level + 1 if block.kind in ("bullet", "numbered") else 0
+            tag = "ul" if block.kind == "bullet" else "ol"
+            # close the lists deeper than this block, or of the other kind at its depth
+            while len(open_lists) > depth or (open_lists and len(open_lists) == depth and open_lists[-1] != tag):
+                parts.append(f"</li></{open_lists.pop()}>")
+            if depth:
+                if len(open_lists) == depth:
+                    parts.append("</li>")
+                while len(open_lists) < depth:
+                    parts.append(f"<{tag}>")
+                    open_lists.append(tag)
+                parts.append(f"<li>{_html_runs(block.runs)}")
+            elif block.kind == "heading":
+                # the title is the only first level heading of the page
+                level = min(block.level + 1, 6) if document.title else block.level
+                parts.append(f"<h{level}>{_html_runs(block.runs)}</h{level}>")
+            elif block.kind == "rule":
+                parts.append("<hr>")
+            else:
+                parts.append(f"<p>{_html_runs(block.runs)}</p>")
+        while open_lists:
+            parts.append(f"</li></{open_lists.pop()}>")
+        parts.append("</body></html>")
+        return "\n".join(parts).encode("utf-8")
+
+
+# define a function to make text printable with the core PDF fonts
+def _pdf_text(text):
+    """_summary_: Encode text for the core PDF fonts, which cover the Windows-1252 characters, so typographic quotes,
+        dashes and bullets are kept, and replace the characters they cannot show, e.g. emoji.
+    """
+    return text.encode("cp1252", "replace").decode("latin-1")
+
+
+# define a function to write the runs of a block as HTML
+def _html_runs(runs):
+    """_summary_: Write the runs of a block as escaped HTML with strong and em tags."""
+    parts = []
+    for run in runs:
+        text = html.escape(run.text)
+        if run.italic:
+            text = f"<em>{text}</em>"
+        if run.bold:
+            text = f"<strong>{text}</strong>"
+        parts.append(text)
+    return "".join(parts)
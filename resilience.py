@@ -0,0 +1,226 @@
+# import necessary libraries
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+import httpx
+import requests
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+# HTTP statuses worth retrying: timeouts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+logger = logging.getLogger("sales_aipe.resilience")
+
+
+# define the CircuitOpenError class
+class CircuitOpenError(RuntimeError):
+    """_summary_: Raised instead of calling a backend that failed repeatedly and is left alone for a while."""
+
+
+# define the status_code function
+def status_code(error):
+    """_summary_: Find the HTTP status of an API error, from the Groq SDK, httpx or requests.
+        _params_: error (Exception): The error raised by the API call.
+    _returns_: int: The HTTP status, or None if the error has no response.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+# define the is_retryable function
+def is_retryable(error):
+    """_summary_: Decide whether an API error is transient, i.e. a rate limit, timeout, dropped connection or
+        server error, rather than a bad request that would fail again.
+        _params_: error (Exception): The error raised by the API call.
+    _returns_: bool: True if the call should be retried.
+    """
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError,
+                          requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    # the Groq SDK wraps httpx transport errors in its own classes
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+# define the retry_after function
+def retry_after(error):
+    """_summary_: Read the number of seconds a rate limited API asks to wait, from its Retry-After header.
+        _params_: error (Exception): The error raised by the API call.
+    _returns_: float: The seconds to wait, or None if the API did not say.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# define the CircuitBreaker class
+class CircuitBreaker:
+    """_summary_: Stop calling a backend after consecutive failures, and let one trial call through once
+        reset_timeout has passed. The circuit closes again when the trial call succeeds.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """_summary_: Create a closed circuit.
+            _params_: name (str): The name of the backend, used in errors and logs.
+            failure_threshold (int): The number of consecutive failures that open the circuit.
+            reset_timeout (float): The seconds the circuit stays open before a trial call is let through.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        """_summary_: Return "closed", "open" or "half-open"."""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+    def before_call(self):
+        """_summary_: Check that the backend may be called, raising CircuitOpenError otherwise."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            # once the timeout has passed, a single trial call decides whether the circuit closes
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError(f"{self.name} is unavailable after repeated failures, "
+                                       f"retrying in {max(remaining, 0):.0f} seconds")
+            self._trial_running = True
+
+    def record_success(self):
+        """_summary_: Close the circuit after a successful call."""
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit of {self.name} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        """_summary_: Count a failed call, opening the circuit at the threshold or when the trial call failed."""
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    logger.warning(f"Circuit of {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+
+# define the Backend class
+class Backend:
+    """_summary_: Process-wide call policy of one API backend, shared by every session and worker.
+        Calls wait for a token bucket rate limiter, are retried with exponential backoff and jitter on
+        transient errors, are refused while the circuit breaker is open, and identical calls in flight at the
+        same time are coalesced into one.
+    """
+
+    def __init__(self, name, requests_per_minute, burst=5, retries=3, base_delay=1.0, max_delay=30.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        """_summary_: Create the policy of a backend.
+            _params_: name (str): The name of the backend, used in errors and logs.
+            requests_per_minute (float): The sustained request rate allowed by the provider.
+            burst (int): The number of requests that may be sent at once after an idle period.
+            retries (int): The number of times a failed call is retried.
+            base_delay (float): The seconds waited before the first retry, doubled for every further retry.
+            max_delay (float): The maximum seconds waited before a retry.
+            failure_threshold (int): The number of consecutive failures that open the circuit.
+            reset_timeout (float): The seconds the circuit stays open.
+        """
+        self.name = name
+        self.burst = burst
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.set_rate(requests_per_minute)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def set_rate(self, requests_per_minute):
+        """_summary_: Change the sustained request rate, e.g. to match the plan of an API key.
+            _params_: requests_per_minute (float): The sustained request rate allowed by the provider.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.rate_limiter = InMemoryRateLimiter(requests_per_second=requests_per_minute / 60,
+                                                check_every_n_seconds=0.05, max_bucket_size=self.burst)
+        # start with a full bucket, so the concurrent lookups of the first request are not spread out
+        self.rate_limiter.available_tokens = self.burst
+
+    def backoff(self, attempt, error):
+        """_summary_: Compute the seconds to wait before a retry, with full jitter.
+            _params_: attempt (int): The number of the retry, starting at 0.
+            error (Exception): The error of the failed call, whose Retry-After header is honored.
+        _returns_: float: The seconds to wait.
+        """
+        # full jitter spreads the retries of concurrent sessions instead of sending them together
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, min(retry_after(error) or 0, self.max_delay))
+
+    def call(self, func, *args, key=None, **kwargs):
+        """_summary_: Call the backend under its rate limit, retry and circuit breaker policy.
+            _params_: func (callable): The API call.
+            args: The positional arguments of the call.
+            key (str): Optional key of the call. A call with the same key as one in flight waits for it and
+                shares its result instead of calling the backend again.
+            kwargs: The keyword arguments of the call.
+        _returns_: object: The result of the call.
+        """
+        if key is None:
+            return self._call(func, *args, **kwargs)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = self._call(func, *args, **kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _call(self, func, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            self.rate_limiter.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # a bad request says nothing about the health of the backend
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                # no point waiting for a retry the open circuit would refuse
+                if attempt == self.retries or self.breaker.state != "closed":
+                    raise
+                delay = self.backoff(attempt, e)
+                logger.warning(f"Retrying {self.name} in {delay:.1f} seconds after error: {str(e)}")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
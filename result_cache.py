@@ -0,0 +1,218 @@
+# import necessary libraries
+import hashlib
+import json
+import time
+from urllib.parse import urlsplit
+from sqlite_store import SQLiteStore
+
+
+# define the normalize_url function
+def normalize_url(url):
+    """_summary_: Normalize a website URL so that equivalent spellings share one cache entry.
+        _params_: url (str): The URL entered by the user, e.g. "https://www.Apple.com/".
+    _returns_: str: The normalized URL, e.g. "apple.com".
+    """
+    url = url.strip().lower()
+    # urlsplit only finds the host when a scheme is present
+    if "://" not in url:
+        url = f"http://{url}"
+    parts = urlsplit(url)
+    host = parts.netloc
+    if host.startswith("www."):
+        host = host[len("www."):]
+    path = parts.path.rstrip("/")
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{host}{path}{query}"
+
+
+# define the normalize_text function
+def normalize_text(text):
+    """_summary_: Normalize free-form text so that casing and whitespace differences do not change a fingerprint.
+        _params_: text (str): The text to normalize.
+    _returns_: str: The text with collapsed whitespace, in lower case.
+    """
+    return " ".join((text or "").split()).casefold()
+
+
+# define the fingerprint function
+def fingerprint(*parts):
+    """_summary_: Compute a content hash of JSON-serializable values, used as a cache key.
+        _params_: parts: The values that identify a result.
+    _returns_: str: The hex SHA-256 digest of the values.
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# define the ResultCache class
+class ResultCache(SQLiteStore):
+    """_summary_: On-disk key/value cache of JSON results, shared by every Streamlit session and process.
+        Entries expire after a TTL, and the least recently used entries are evicted once the cache is full.
+        Hit and miss counters are stored in the database so they are shared as well.
+    """
+
+    def __init__(self, path, ttl=24 * 60 * 60, max_entries=5000):
+        """_summary_: Open (and create if needed) the cache database.
+            _params_: path (str): The path of the SQLite database file.
+            ttl (float): The number of seconds a cached result stays valid.
+            max_entries (int): The maximum number of results kept in the cache.
+        """
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def _key(self, key):
+        """_summary_: Turn a caller's key into the key stored in the database. Subclasses normalize it here.
+            _params_: key (str): The key passed to get or set.
+        _returns_: str: The stored key.
+        """
+        return key
+
+    def get(self, key):
+        """_summary_: Look up a cached result.
+            _params_: key (str): The key of the result.
+        _returns_: The cached result, or None if there is no fresh entry for the key.
+        """
+        key = self._key(key)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+                return json.loads(row[0])
+            # drop the expired entry, if any, and count the miss
+            if row:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+            return None
+
+    def set(self, key, value):
+        """_summary_: Store a result and evict the least recently used entries if the cache is full.
+            _params_: key (str): The key of the result.
+            value: The JSON-serializable result to cache.
+        """
+        key = self._key(key)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            conn.execute(
+                "DELETE FROM entries WHERE key IN ("
+                "SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def age(self, key):
+        """_summary_: Return how long ago a result was stored, without counting a hit or a miss.
+            _params_: key (str): The key of the result.
+        _returns_: float: The age of the entry in seconds, or None if there is no entry for the key.
+        """
+        row = self._connect().execute("SELECT created_at FROM entries WHERE key = ?", (self._key(key),)).fetchone()
+        return None if row is None else time.time() - row[0]
+
+    def stats(self):
+        """_summary_: Return the cache counters.
+        _returns_: dict: The number of hits, misses and entries currently stored.
+        """
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": counters.get("hits", 0), "misses": counters.get("misses", 0), "entries": entries}
+
+    def clear(self):
+        """_summary_: Remove every cached result and reset the counters."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("UPDATE counters SET value = 0")
+
+
+# define the ScrapeCache class
+class ScrapeCache(ResultCache):
+    """_summary_: Cache of scrape_website results, keyed by normalized URL."""
+
+    def __init__(self, path="cache/scrape_cache.sqlite3", ttl=24 * 60 * 60, max_entries=5000):
+        super().__init__(path, ttl=ttl, max_entries=max_entries)
+
+    def _key(self, key):
+        return normalize_url(key)
+
+
+# define the InsightCache class
+class InsightCache(ResultCache):
+    """_summary_: Content-addressed cache of generated insights, keyed by the fingerprint of the inputs and model settings."""
+
+    def __init__(self, path="cache/insight_cache.sqlite3", ttl=7 * 24 * 60 * 60, max_entries=500):
+        super().__init__(path, ttl=ttl, max_entries=max_entries)
+
+    @staticmethod
+    def fingerprint(inputs, model_settings):
+        """_summary_: Compute the cache key of an insights request.
+            _params_: inputs (dict): The form inputs, optionally including the parsed "uploaded_file" text and the
+                "uploaded_file_hash" of the document bytes. The hash is used when present, so a document whose
+                digest is regenerated still maps to the same key.
+            model_settings (dict): The model name, temperature, max tokens and anything else that changes the output.
+        _returns_: str: The hex SHA-256 fingerprint of the normalized inputs and settings.
+        """
+        competitors = [normalize_url(url) for url in (inputs.get("competitors") or "").split(",") if url.strip()]
+        uploaded_file = inputs.get("uploaded_file") or ""
+        normalized = {
+            "product_name": normalize_text(inputs.get("product_name")),
+            "company_url": normalize_url(inputs.get("company_url") or ""),
+            "product_category": normalize_text(inputs.get("product_category")),
+            # the order of the competitors is kept, it is the order they appear in the report
+            "competitors": competitors,
+            "value_proposition": normalize_text(inputs.get("value_proposition")),
+            "target_customer": normalize_text(inputs.get("target_customer")),
+            "uploaded_file": (inputs.get("uploaded_file_hash")
+                              or (hashlib.sha256(uploaded_file.encode("utf-8")).hexdigest() if uploaded_file else None)),
+        }
+        return fingerprint(normalized, model_settings)
+
+
+# define the DocumentCache class
+class DocumentCache(ResultCache):
+    """_summary_: Content-addressed cache of the page texts extracted from uploaded documents, keyed by the hash
+        of the file bytes. Besides the number of documents, the total size of the stored text is bounded.
+    """
+
+    def __init__(self, path="cache/document_cache.sqlite3", ttl=30 * 24 * 60 * 60, max_entries=1000,
+                 max_bytes=256 * 1024 * 1024, max_document_chars=4 * 1024 * 1024):
+        """_summary_: Open (and create if needed) the cache database.
+            _params_: path (str): The path of the SQLite database file.
+            ttl (float): The number of seconds a cached document stays valid.
+            max_entries (int): The maximum number of documents kept in the cache.
+            max_bytes (int): The maximum total size of the cached text, least recently used documents are
+                evicted beyond it.
+            max_document_chars (int): The size of the largest document cached, larger ones are parsed every time
+                rather than held in memory until they can be stored.
+        """
+        super().__init__(path, ttl=ttl, max_entries=max_entries)
+        self.max_bytes = max_bytes
+        self.max_document_chars = max_document_chars
+
+    def set(self, key, value):
+        """_summary_: Store the pages of a document and evict the least recently used documents beyond the
+            entry and size limits.
+            _params_: key (str): The hash of the file bytes.
+            value (list): The text of each page.
+        """
+        super().set(key, value)
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM entries WHERE key IN ("
+                "SELECT key FROM (SELECT key, SUM(LENGTH(CAST(value AS BLOB))) OVER "
+                "(ORDER BY accessed_at DESC, key) AS total FROM entries) WHERE total > ?)",
+                (self.max_bytes,),
+            )
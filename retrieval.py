@@ -0,0 +1,121 @@
+# import necessary libraries
+import re
+import time
+from sqlite_store import SQLiteStore
+
+DOCUMENT = "document"  # kind of the passages of uploaded documents
+INSIGHT = "insight"  # kind of the passages of generated insights
+
+
+# define the build_match_query function
+def build_match_query(text):
+    """_summary_: Turn free-form text into an FTS5 query that matches any of its words.
+        _params_: text (str): The text to search for, e.g. the product name and value proposition.
+    _returns_: str: The FTS5 MATCH expression, or an empty string if the text has no words.
+    """
+    # quoting every word keeps FTS5 operators and punctuation in the user's text from breaking the query
+    words = dict.fromkeys(word.lower() for word in re.findall(r"\w+", text) if len(word) > 1)
+    return " OR ".join(f'"{word}"' for word in words)
+
+
+# define the PassageIndex class
+class PassageIndex(SQLiteStore):
+    """_summary_: Local BM25 full-text index of uploaded document chunks, keyed by the file hash, and of
+        previously generated insights. Shared by every Streamlit session and process through SQLite.
+    """
+
+    def __init__(self, path="cache/passage_index.sqlite3", max_sources=2000):
+        """_summary_: Open (and create if needed) the index database.
+            _params_: path (str): The path of the SQLite database file.
+            max_sources (int): The maximum number of documents and insights kept, the least recently used are
+                evicted beyond it.
+        """
+        super().__init__(path)
+        self.max_sources = max_sources
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                "source TEXT PRIMARY KEY, kind TEXT NOT NULL, name TEXT, passages INTEGER NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            # porter stemming lets "tracking" match "tracks"
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5("
+                "text, source UNINDEXED, kind UNINDEXED, position UNINDEXED, tokenize='porter unicode61')"
+            )
+
+    def get_source(self, source):
+        """_summary_: Look up an indexed document or insight, marking it as recently used.
+            _params_: source (str): The file hash of a document, or the fingerprint of an insight.
+        _returns_: dict: The kind, name and number of passages of the source, or None if it is not indexed.
+        """
+        # created_at is refreshed on every hit, so eviction drops the least recently used sources, not the oldest
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE sources SET created_at = ? WHERE source = ? RETURNING kind, name, passages",
+                (time.time(), source)
+            ).fetchone()
+        return {"kind": row[0], "name": row[1], "passages": row[2]} if row else None
+
+    def add(self, source, kind, name, passages):
+        """_summary_: Index the passages of a document or insight, replacing any earlier version of it.
+            _params_: source (str): The file hash of a document, or the fingerprint of an insight.
+            kind (str): DOCUMENT or INSIGHT.
+            name (str): A label shown with the passages, e.g. the file name.
+            passages (iterable): The passages, e.g. a generator of document chunks.
+        _returns_: int: The number of passages indexed.
+        """
+        # read the passages before the write transaction, so a slow document extraction does not hold the
+        # database lock that every other session needs to index its own passages
+        rows = [(text, source, kind, position) for position, text in enumerate(passages)]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM passages WHERE source = ?", (source,))
+            conn.executemany("INSERT INTO passages (text, source, kind, position) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+                         (source, kind, name, len(rows), time.time()))
+            # evict the least recently used documents and insights beyond the cap, with their passages
+            evicted = conn.execute("SELECT source FROM sources ORDER BY created_at DESC LIMIT -1 OFFSET ?",
+                                   (self.max_sources,)).fetchall()
+            if evicted:
+                conn.executemany("DELETE FROM passages WHERE source = ?", evicted)
+                conn.executemany("DELETE FROM sources WHERE source = ?", evicted)
+        return len(rows)
+
+    def search(self, query, k=5, source=None, kind=None, exclude_source=None):
+        """_summary_: Find the passages most relevant to a query, ranked by BM25.
+            _params_: query (str): Free-form text to search for.
+            k (int): The maximum number of passages to return.
+            source (str): Only search the passages of this document or insight.
+            kind (str): Only search passages of this kind, DOCUMENT or INSIGHT.
+            exclude_source (str): Skip the passages of this document or insight.
+        _returns_: list: The text of the matching passages, most relevant first, in their original order
+            when they tie.
+        """
+        match = build_match_query(query)
+        if not match:
+            return []
+        sql = "SELECT text FROM passages WHERE passages MATCH ?"
+        params = [match]
+        if source:
+            sql += " AND source = ?"
+            params.append(source)
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        if exclude_source:
+            sql += " AND source != ?"
+            params.append(exclude_source)
+        sql += " ORDER BY bm25(passages), position LIMIT ?"
+        params.append(k)
+        return [row[0] for row in self._connect().execute(sql, params).fetchall()]
+
+    def first_passages(self, source, k=5):
+        """_summary_: Read the first passages of a document or insight, in their original order.
+            _params_: source (str): The file hash of a document, or the fingerprint of an insight.
+            k (int): The maximum number of passages to return.
+        _returns_: list: The text of the passages.
+        """
+        rows = self._connect().execute(
+            "SELECT text FROM passages WHERE source = ? ORDER BY position LIMIT ?", (source, k)
+        ).fetchall()
+        return [row[0] for row in rows]
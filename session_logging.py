@@ -0,0 +1,115 @@
+# import necessary libraries
+import atexit
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Settings of the shared session log
+LOG_DIR = "session_logs"
+LOG_FILE = "sessions.log"
+EVENTS_FILE = "events.jsonl"  # structured JSON events, one per line
+LOG_MAX_BYTES = 5 * 1024 * 1024  # size at which the log file is rotated
+LOG_BACKUP_COUNT = 10  # number of rotated log files kept
+LOG_QUEUE_SIZE = 10000  # records waiting to be written before new ones are dropped
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(session_id)s - %(message)s'
+
+SESSIONS_LOGGER = "sales_aipe.sessions"
+EVENTS_LOGGER = "sales_aipe.events"
+
+_lock = threading.Lock()
+_log_queue = None
+
+
+# define the BoundedQueueHandler class
+class BoundedQueueHandler(QueueHandler):
+    """_summary_: Queue handler that drops records instead of blocking when the queue is full,
+        so a slow disk can never stall a request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# define the SessionIdFilter class
+class SessionIdFilter(logging.Filter):
+    """_summary_: Give records logged without a session ID a placeholder, so the formatter never fails."""
+
+    def filter(self, record):
+        if not hasattr(record, "session_id"):
+            record.session_id = "-"
+        return True
+
+
+# define a function to build a rotating file handler
+def _rotating_handler(filename, log_format, logger_name):
+    """_summary_: Build a size-rotated file handler that only writes the records of one logger."""
+    handler = RotatingFileHandler(os.path.join(LOG_DIR, filename), maxBytes=LOG_MAX_BYTES,
+                                  backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True)
+    handler.setFormatter(logging.Formatter(log_format))
+    handler.addFilter(logging.Filter(logger_name))
+    return handler
+
+
+# define a function to get a logger of the background writer
+def _get_logger(name):
+    """_summary_: Return a process-wide logger that writes through the background writer, starting it on first use.
+        Records go through a bounded queue to one listener thread that writes size-rotated files.
+        _params_: name (str): SESSIONS_LOGGER or EVENTS_LOGGER.
+    _returns_: logging.Logger: The shared logger.
+    """
+    global _log_queue
+    with _lock:
+        if _log_queue is None:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            sessions_handler = _rotating_handler(LOG_FILE, LOG_FORMAT, SESSIONS_LOGGER)
+            sessions_handler.addFilter(SessionIdFilter())
+            events_handler = _rotating_handler(EVENTS_FILE, "%(message)s", EVENTS_LOGGER)
+
+            _log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            listener = QueueListener(_log_queue, sessions_handler, events_handler, respect_handler_level=True)
+            listener.start()
+            # flush the queued records when the process exits
+            atexit.register(listener.stop)
+
+        logger = logging.getLogger(name)
+        if not logger.handlers:
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(BoundedQueueHandler(_log_queue))
+        return logger
+
+
+# define a function to get the shared session logger
+def get_shared_logger():
+    """_summary_: Return the process-wide session logger, which writes to session_logs/sessions.log.
+    _returns_: logging.Logger: The shared logger.
+    """
+    return _get_logger(SESSIONS_LOGGER)
+
+
+# define a function to get the structured event logger
+def get_event_logger():
+    """_summary_: Return the process-wide event logger, which writes one JSON event per line to
+        session_logs/events.jsonl.
+    _returns_: logging.Logger: The event logger.
+    """
+    return _get_logger(EVENTS_LOGGER)
+
+
+# define a function to get the logger of a session
+def get_session_logger(session_id):
+    """_summary_: Return a logger that stamps every record with a session ID.
+        All sessions share one logger and one file handler, so nothing is left open when a session ends.
+        _params_: session_id (str): The ID of the session.
+    _returns_: logging.LoggerAdapter: The session logger.
+    """
+    return logging.LoggerAdapter(get_shared_logger(), {"session_id": session_id})
@@ -0,0 +1,39 @@
+# import necessary libraries
+import os
+import sqlite3
+import threading
+
+SQLITE_TIMEOUT = 10  # seconds a connection waits for a lock held by another session or process
+
+
+# define the SQLiteStore class
+class SQLiteStore:
+    """_summary_: Base of the stores kept in a SQLite database shared by every Streamlit session and process.
+        Every thread gets its own connection, opened on first use.
+    """
+    row_factory = None  # e.g. sqlite3.Row, for stores that read their rows by column name
+
+    def __init__(self, path):
+        """_summary_: Prepare the database file, creating its directory if needed.
+            _params_: path (str): The path of the SQLite database file.
+        """
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connect(self):
+        """_summary_: Return the SQLite connection of the current thread, opening it on first use.
+        _returns_: sqlite3.Connection: The connection to the database.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+            if self.row_factory:
+                conn.row_factory = self.row_factory
+            # WAL lets readers in other processes work while one process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn